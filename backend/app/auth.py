@@ -1,3 +1,4 @@
+import asyncio
 from datetime import datetime, timedelta
 from typing import Optional
 
@@ -5,7 +6,8 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from . import models, db
 
@@ -25,10 +27,14 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+async def get_user_by_email(db: AsyncSession, email: str) -> Optional[models.User]:
+    return (await db.execute(select(models.User).where(models.User.email == email))).scalars().first()
+
 # user auth
-def authenticate_user(db: Session, email: str, password: str) -> Optional[models.User]:
-    user = db.query(models.User).filter(models.User.email == email).first()
-    if not user or not verify_password(password, user.hashed_password):
+async def authenticate_user(db: AsyncSession, email: str, password: str) -> Optional[models.User]:
+    user = await get_user_by_email(db, email)
+    # bcrypt is deliberately slow, keep it off the event loop
+    if not user or not await asyncio.to_thread(verify_password, password, user.hashed_password):
         return None
     return user
 
@@ -40,7 +46,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(db.get_db)) -> models.User:
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(db.get_async_db)) -> models.User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -57,7 +63,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         print("JWTError:", e)
         raise credentials_exception
 
-    user = db.query(models.User).filter(models.User.email == email).first()
+    user = await get_user_by_email(db, email)
     if user is None:
         print("User not found for email:", email)
         raise credentials_exception
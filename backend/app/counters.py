@@ -0,0 +1,123 @@
+import sys
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from . import db, models
+from .db import upsert_add
+
+TOTAL_USERS = "total_users"
+TOTAL_CHECKINS = "total_checkins"
+TOTAL_IMPACT = "total_impact_score"
+ACTIVITY_PREFIX = "activity:"
+
+
+def activity_key(activity_type: models.ActivityType) -> str:
+    return ACTIVITY_PREFIX + (activity_type or models.ActivityType.OCEAN_EDUCATION).value
+
+
+# apply deltas inside the caller's transaction, the caller commits
+def increment(db: Session, deltas: dict):
+    for name, delta in deltas.items():
+        upsert_add(db, models.CommunityCounter, {"name": name}, {"value": delta})
+
+
+def _add_user_impact(db: Session, user_id: int, delta: float):
+    db.execute(
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(total_impact_score=func.coalesce(models.User.total_impact_score, 0.0) + delta)
+    )
+
+
+def record_signup(db: Session):
+    increment(db, {TOTAL_USERS: 1})
+
+
+def record_checkin(db: Session, checkin: models.HabitCheckIn, habit: models.Habit):
+    score = checkin.impact_score or 0.0
+    increment(db, {TOTAL_CHECKINS: 1, TOTAL_IMPACT: score, activity_key(habit.activity_type): 1})
+    _add_user_impact(db, habit.owner_id, score)
+
+
+def record_habit_deleted(db: Session, habit: models.Habit):
+    count, score = db.query(
+        func.count(models.HabitCheckIn.id), func.coalesce(func.sum(models.HabitCheckIn.impact_score), 0.0)
+    ).filter(models.HabitCheckIn.habit_id == habit.id).one()
+    if not count:
+        return
+    increment(db, {TOTAL_CHECKINS: -count, TOTAL_IMPACT: -score, activity_key(habit.activity_type): -count})
+    _add_user_impact(db, habit.owner_id, -score)
+
+
+def read_counters(db: Session) -> dict:
+    return {name: value for name, value in db.query(models.CommunityCounter.name, models.CommunityCounter.value)}
+
+
+def activity_breakdown(counters: dict) -> dict:
+    return {
+        name[len(ACTIVITY_PREFIX):]: int(value)
+        for name, value in counters.items()
+        if name.startswith(ACTIVITY_PREFIX) and value
+    }
+
+
+# recompute every counter from the source tables and overwrite any drift
+def reconcile(db: Session) -> dict:
+    expected = {
+        TOTAL_USERS: db.query(func.count(models.User.id)).scalar() or 0,
+        TOTAL_CHECKINS: db.query(func.count(models.HabitCheckIn.id)).scalar() or 0,
+        TOTAL_IMPACT: db.query(func.sum(models.HabitCheckIn.impact_score)).scalar() or 0.0,
+    }
+    for activity in models.ActivityType:
+        expected[activity_key(activity)] = 0
+    activity_counts = db.query(
+        models.Habit.activity_type, func.count(models.HabitCheckIn.id)
+    ).join(models.HabitCheckIn, models.HabitCheckIn.habit_id == models.Habit.id).group_by(models.Habit.activity_type)
+    for activity, count in activity_counts:
+        expected[activity_key(activity)] = count
+
+    # check-ins archived into monthly summaries still count towards the totals
+    summary = models.CheckInMonthlySummary
+    archived_count, archived_score = db.query(
+        func.coalesce(func.sum(summary.checkins), 0), func.coalesce(func.sum(summary.impact_score), 0.0)
+    ).one()
+    expected[TOTAL_CHECKINS] += archived_count
+    expected[TOTAL_IMPACT] += archived_score
+    for activity, count in db.query(summary.activity_type, func.sum(summary.checkins)).group_by(summary.activity_type):
+        expected[activity_key(activity)] += count
+
+    current = read_counters(db)
+    drift = {name: value - current.get(name, 0.0) for name, value in expected.items() if value != current.get(name, 0.0)}
+    for name, value in expected.items():
+        row = db.get(models.CommunityCounter, name)
+        if row is None:
+            db.add(models.CommunityCounter(name=name, value=value))
+        else:
+            row.value = value
+
+    # per user impact from their check-ins
+    user_score = select(
+        func.coalesce(func.sum(models.HabitCheckIn.impact_score), 0.0)
+    ).join(models.Habit, models.Habit.id == models.HabitCheckIn.habit_id).where(
+        models.Habit.owner_id == models.User.id
+    ).scalar_subquery()
+    archived_score = select(
+        func.coalesce(func.sum(summary.impact_score), 0.0)
+    ).where(summary.user_id == models.User.id).scalar_subquery()
+    db.execute(update(models.User).values(total_impact_score=user_score + archived_score))
+    db.commit()
+    return drift
+
+
+if __name__ == "__main__":
+    # python -m app.counters reconcile
+    if sys.argv[1:] != ["reconcile"]:
+        print("usage: python -m app.counters reconcile")
+        sys.exit(1)
+    session = db.SessionLocal()
+    try:
+        drift = reconcile(session)
+        print("Counters reconciled, drift:", drift or "none")
+    finally:
+        session.close()
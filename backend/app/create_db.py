@@ -1,4 +1,12 @@
+import os
+
+from alembic import command
+from alembic.config import Config
+
 from app.db import engine, Base
 from app import models
 
+# fresh databases get the current schema and are marked fully migrated,
+# existing ones should run `alembic upgrade head` from backend/ instead
 Base.metadata.create_all(bind=engine)
+command.stamp(Config(os.path.join(os.path.dirname(__file__), "..", "alembic.ini")), "head")
@@ -1,11 +1,80 @@
-from sqlalchemy import create_engine
+import asyncio
+import os
+import time
+
+from sqlalchemy import create_engine, exc, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-DATABASE_URL = "postgresql://protimabanerjee@localhost:5432/blue_steps_db"
+from .db_pool import PoolMetrics, TimedQueuePool, TimedAsyncQueuePool
+from .replica import ReplicaRouter
+
+DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://protimabanerjee@localhost:5432/blue_steps_db")
+
+# connection pool config, applied to the sync and the async engine separately
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))  # -1 never recycles
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_HEALTH_TIMEOUT_SECONDS = float(os.getenv("DB_HEALTH_TIMEOUT_SECONDS", "5"))
+
+# optional read replica for read-only endpoints
+REPLICA_DATABASE_URL = os.getenv("REPLICA_DATABASE_URL")
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "30"))
+REPLICA_CHECK_SECONDS = float(os.getenv("REPLICA_CHECK_SECONDS", "5"))
+
+# async drivers for the request path
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
 
-engine = create_engine(DATABASE_URL)
+def to_async_url(url: str) -> str:
+    scheme, rest = url.split("://", 1)
+    return ASYNC_DRIVERS.get(scheme, scheme) + "://" + rest
+
+
+def pool_options(url: str, poolclass) -> dict:
+    options = {"pool_pre_ping": DB_POOL_PRE_PING}
+    # in-memory sqlite keeps its single shared connection pool
+    if url.startswith("sqlite") and (url.endswith("://") or ":memory:" in url):
+        return options
+    options.update({
+        "poolclass": poolclass,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT_SECONDS,
+        "pool_recycle": DB_POOL_RECYCLE_SECONDS,
+    })
+    return options
+
+
+# sync engine for migrations, CLI jobs and background threads
+engine = create_engine(DATABASE_URL, **pool_options(DATABASE_URL, TimedQueuePool))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# async engine for request handlers, keeps DB waits off the event loop
+ASYNC_DATABASE_URL = to_async_url(DATABASE_URL)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **pool_options(ASYNC_DATABASE_URL, TimedAsyncQueuePool))
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+pool_metrics = {
+    "sync": PoolMetrics("sync").attach(engine),
+    "async": PoolMetrics("async").attach(async_engine.sync_engine),
+}
+
+# reads that can tolerate replica lag go here when a replica is configured
+replica_engine = None
+replica_router = None
+ReadSessionLocal = None
+if REPLICA_DATABASE_URL:
+    REPLICA_ASYNC_URL = to_async_url(REPLICA_DATABASE_URL)
+    replica_engine = create_async_engine(REPLICA_ASYNC_URL, **pool_options(REPLICA_ASYNC_URL, TimedAsyncQueuePool))
+    ReadSessionLocal = async_sessionmaker(replica_engine, autoflush=False, expire_on_commit=False)
+    replica_router = ReplicaRouter(replica_engine, REPLICA_MAX_LAG_SECONDS, REPLICA_CHECK_SECONDS)
+    pool_metrics["replica"] = PoolMetrics("replica").attach(replica_engine.sync_engine)
+
 Base = declarative_base()
 
 def get_db():
@@ -14,3 +83,75 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# errors that mean the replica itself is unusable rather than a bad query
+REPLICA_ERRORS = (exc.OperationalError, exc.InterfaceError, OSError, asyncio.TimeoutError)
+
+# read-only dependency, replica when it's healthy and caught up, primary otherwise
+async def get_read_db():
+    if replica_router is not None and await replica_router.use_replica():
+        db = ReadSessionLocal()
+        try:
+            # connect before handing the session out so a dead replica falls back to the primary
+            await db.connection()
+        except REPLICA_ERRORS as e:
+            await db.close()
+            replica_router.mark_unhealthy(e)
+        else:
+            try:
+                yield db
+            except REPLICA_ERRORS as e:
+                # too late to retry this request, the next ones go to the primary
+                replica_router.mark_unhealthy(e)
+                raise
+            finally:
+                await db.close()
+            return
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# add deltas to the row matching keys, inserting it with the deltas when it's missing.
+# one INSERT .. ON CONFLICT DO UPDATE so concurrent first writes can't both try the insert
+def upsert_add(session, model, keys: dict, deltas: dict):
+    dialect = session.get_bind().dialect.name
+    if dialect not in ("postgresql", "sqlite"):
+        updated = session.execute(
+            update(model).where(*(getattr(model, name) == value for name, value in keys.items()))
+            .values({name: getattr(model, name) + delta for name, delta in deltas.items()})
+        ).rowcount
+        if not updated:
+            session.add(model(**keys, **deltas))
+            session.flush()
+        return
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    stmt = insert(model).values(**keys, **deltas)
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={name: getattr(model, name) + stmt.excluded[name] for name in deltas},
+    ))
+
+def pool_stats() -> dict:
+    stats = {
+        "sync": pool_metrics["sync"].stats(engine.pool),
+        "async": pool_metrics["async"].stats(async_engine.sync_engine.pool),
+    }
+    if replica_engine is not None:
+        stats["replica"] = {
+            **pool_metrics["replica"].stats(replica_engine.sync_engine.pool),
+            "routing": replica_router.stats(),
+        }
+    return stats
+
+async def _select_one():
+    async with async_engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+
+# round trip through the request-path pool, bounded so an exhausted pool reports unhealthy fast
+async def check_database(timeout: float = DB_HEALTH_TIMEOUT_SECONDS) -> dict:
+    start = time.perf_counter()
+    await asyncio.wait_for(_select_one(), timeout)
+    return {"latency_ms": round((time.perf_counter() - start) * 1000, 2)}
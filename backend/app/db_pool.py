@@ -0,0 +1,104 @@
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+
+class PoolMetrics:
+    """Checkout wait, timeout and overflow counters for one engine's pool."""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.overflow_checkouts = 0  # checkouts that had to open a connection beyond pool_size
+        self.timeouts = 0  # QueuePool limit reached
+        self.connects = 0
+        self.invalidations = 0  # includes connections dropped by pre-ping
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record_checkout(self, waited, overflowed):
+        with self._lock:
+            self.checkouts += 1
+            self.overflow_checkouts += overflowed
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def record_timeout(self, waited):
+        with self._lock:
+            self.timeouts += 1
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def attach(self, engine):
+        pool = engine.pool
+        pool.metrics = self
+
+        @event.listens_for(engine, "connect")
+        def _on_connect(dbapi_connection, connection_record):
+            self.connects += 1
+
+        @event.listens_for(engine, "invalidate")
+        def _on_invalidate(dbapi_connection, connection_record, exception):
+            self.invalidations += 1
+
+        return self
+
+    def stats(self, pool):
+        with self._lock:
+            snapshot = {
+                "checkouts": self.checkouts,
+                "overflow_checkouts": self.overflow_checkouts,
+                "timeouts": self.timeouts,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "avg_wait_ms": round(self.wait_seconds_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "max_wait_ms": round(self.wait_seconds_max * 1000, 3),
+            }
+        if isinstance(pool, QueuePool):
+            snapshot.update({
+                "pool_size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                "overflow": pool.overflow(),
+                "timeout_seconds": pool.timeout(),
+            })
+        return {"name": self.name, "pool": type(pool).__name__, **snapshot}
+
+
+class _TimedPoolMixin:
+    metrics = None
+
+    # time every checkout, including waits for a free slot
+    def connect(self):
+        metrics = self.metrics
+        if metrics is None:
+            return super().connect()
+        overflow_before = self.overflow()
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            metrics.record_timeout(time.perf_counter() - start)
+            print(f"{metrics.name} pool exhausted: {self.status()}")
+            raise
+        # overflow() starts at -pool_size and rises with every new connection,
+        # only a rise past zero means a connection beyond pool_size was opened
+        overflow_after = self.overflow()
+        metrics.record_checkout(time.perf_counter() - start, overflow_after > 0 and overflow_after > overflow_before)
+        return connection
+
+    # dispose() swaps in a fresh pool, keep counting into the same metrics
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
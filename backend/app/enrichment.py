@@ -0,0 +1,194 @@
+import asyncio
+import os
+
+from . import db, models
+from .ocean_data import fetch_marine_data_batch, MARINE_BATCH_SIZE
+from .snapshots import save_marine_snapshots
+
+# background enrichment config
+ENRICHMENT_WORKERS = int(os.getenv("ENRICHMENT_WORKERS", "4"))
+ENRICHMENT_MAX_ATTEMPTS = int(os.getenv("ENRICHMENT_MAX_ATTEMPTS", "4"))
+ENRICHMENT_BACKOFF_SECONDS = float(os.getenv("ENRICHMENT_BACKOFF_SECONDS", "2.0"))
+ENRICHMENT_BATCH_SIZE = int(os.getenv("ENRICHMENT_BATCH_SIZE", "50"))
+ENRICHMENT_FLUSH_SECONDS = float(os.getenv("ENRICHMENT_FLUSH_SECONDS", "0.5"))
+
+STATUS_PENDING = "pending"
+STATUS_COMPLETE = "complete"
+STATUS_FAILED = "failed"
+
+
+def _save_batch(items, status):
+    session = db.SessionLocal()
+    try:
+        # check-ins deleted while queued have nothing left to attach to
+        checkin_ids = [checkin_id for checkin_id, _ in items]
+        existing = {
+            checkin_id for (checkin_id,) in session.query(models.HabitCheckIn.id)
+            .filter(models.HabitCheckIn.id.in_(checkin_ids))
+        }
+        # another worker process may already have written some of them
+        existing -= {
+            checkin_id for (checkin_id,) in session.query(models.MarineSnapshot.checkin_id)
+            .filter(models.MarineSnapshot.checkin_id.in_(checkin_ids))
+        }
+        items = [item for item in items if item[0] in existing]
+        if items:
+            save_marine_snapshots(session, items, status=status)
+    finally:
+        session.close()
+
+
+def _pending_checkins():
+    session = db.SessionLocal()
+    try:
+        return session.query(
+            models.HabitCheckIn.id, models.HabitCheckIn.latitude, models.HabitCheckIn.longitude
+        ).filter(models.HabitCheckIn.marine_status == STATUS_PENDING).all()
+    finally:
+        session.close()
+
+
+class EnrichmentQueue:
+    """In-process queue that fetches marine data for check-ins off the request path."""
+
+    def __init__(self, workers=ENRICHMENT_WORKERS, max_attempts=ENRICHMENT_MAX_ATTEMPTS,
+                 backoff_seconds=ENRICHMENT_BACKOFF_SECONDS, batch_size=ENRICHMENT_BATCH_SIZE,
+                 flush_seconds=ENRICHMENT_FLUSH_SECONDS, fetch_batch_size=MARINE_BATCH_SIZE):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.fetch_batch_size = fetch_batch_size
+        self._queue = asyncio.Queue()
+        self._tasks = []
+        self._waiters = {}  # checkin_id -> asyncio.Event
+        self._completed = []  # (checkin_id, marine_data) waiting to be written
+        self._failed = []
+        self._flush_now = asyncio.Event()
+        self._flush_failures = 0
+        self.stats = {"completed": 0, "failed": 0, "retries": 0, "batches_written": 0}
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._flusher()))
+        # pick back up anything that was still pending when the process stopped
+        for checkin_id, lat, lon in await asyncio.to_thread(_pending_checkins):
+            self.submit(checkin_id, lat, lon)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Failed to write marine snapshots on shutdown: {e}")
+
+    def submit(self, checkin_id, lat, lon, attempt=1):
+        self._queue.put_nowait((checkin_id, lat, lon, attempt))
+
+    # register before re-checking the check-in so a flush in between still wakes the caller
+    def waiter(self, checkin_id):
+        return self._waiters.setdefault(checkin_id, asyncio.Event())
+
+    async def wait_for(self, checkin_id, timeout):
+        event = self.waiter(checkin_id)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _notify(self, checkin_id):
+        event = self._waiters.pop(checkin_id, None)
+        if event is not None:
+            event.set()
+
+    async def _worker(self):
+        while True:
+            # take whatever else is already queued so it goes out as one multi-location request
+            jobs = [await self._queue.get()]
+            while len(jobs) < self.fetch_batch_size and not self._queue.empty():
+                jobs.append(self._queue.get_nowait())
+            try:
+                await self._process(jobs)
+            except Exception as e:
+                print(f"Enrichment batch of {len(jobs)} jobs crashed: {e}")
+            finally:
+                for _ in jobs:
+                    self._queue.task_done()
+
+    async def _flusher(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Failed to write marine snapshots: {e}")
+
+    # write buffered results in one insert per status, then wake any waiters
+    async def flush(self):
+        completed, self._completed = self._completed, []
+        failed, self._failed = self._failed, []
+        try:
+            if completed:
+                await asyncio.to_thread(_save_batch, completed, STATUS_COMPLETE)
+                self.stats["batches_written"] += 1
+            if failed:
+                await asyncio.to_thread(_save_batch, failed, STATUS_FAILED)
+            self._flush_failures = 0
+        except Exception:
+            self._flush_failures += 1
+            if self._flush_failures < self.max_attempts:
+                # keep the results for the next flush, rows already written are skipped then
+                self._completed = completed + self._completed
+                self._failed = failed + self._failed
+                raise
+            print(f"Dropping {len(completed) + len(failed)} marine results after {self._flush_failures} failed writes")
+            self._flush_failures = 0
+            for checkin_id, _ in completed + failed:
+                self._notify(checkin_id)
+            raise
+        for checkin_id, _ in completed + failed:
+            self._notify(checkin_id)
+
+    def _buffer(self, results, item):
+        results.append(item)
+        if len(self._completed) + len(self._failed) >= self.batch_size:
+            self._flush_now.set()
+
+    async def _process(self, jobs):
+        results = await fetch_marine_data_batch([(lat, lon) for _, lat, lon, _ in jobs])
+        for (checkin_id, lat, lon, attempt), marine_data in zip(jobs, results):
+            if marine_data:
+                self.stats["completed"] += 1
+                self._buffer(self._completed, (checkin_id, marine_data))
+                continue
+
+            if attempt >= self.max_attempts:
+                print(f"Giving up on marine data for check-in {checkin_id} after {attempt} attempts")
+                self.stats["failed"] += 1
+                self._buffer(self._failed, (checkin_id, None))
+                continue
+
+            # exponential backoff without holding a worker while we wait
+            delay = self.backoff_seconds * 2 ** (attempt - 1)
+            self.stats["retries"] += 1
+            asyncio.get_running_loop().call_later(delay, self.submit, checkin_id, lat, lon, attempt + 1)
+
+    def queue_stats(self):
+        return {
+            **self.stats,
+            "queued": self._queue.qsize(),
+            "unwritten": len(self._completed) + len(self._failed),
+            "workers": self.workers if self._tasks else 0,
+        }
+
+
+enrichment_queue = EnrichmentQueue()
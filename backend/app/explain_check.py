@@ -0,0 +1,82 @@
+import sys
+from datetime import date, timedelta
+
+from sqlalchemy import select, func, desc, text, tuple_
+
+from . import db, models, geo
+
+# tables that must never be read with a sequential scan on the hot paths
+GUARDED_TABLES = {"habit_checkins", "habits", "user_daily_scores"}
+# queries whose ORDER BY has to come straight from an index
+INDEX_ORDERED = {"recent_activity"}
+SORT_NODES = {"Sort", "Incremental Sort"}
+
+
+def community_queries():
+    week_ago = date.today() - timedelta(days=7)
+    month_ago = date.today() - timedelta(days=30)
+    checkin, habit, user = models.HabitCheckIn, models.Habit, models.User
+    return {
+        # a later feed page, keyset on (date, id) like /community/recent-activity
+        "recent_activity": select(checkin.id, checkin.date, habit.description, user.name)
+            .join(habit, habit.id == checkin.habit_id)
+            .join(user, user.id == habit.owner_id)
+            .where(tuple_(checkin.date, checkin.id) < (date.today(), 1000000))
+            .order_by(desc(checkin.date), desc(checkin.id))
+            .limit(20),
+        "weekly_checkins": select(func.count(checkin.id)).where(checkin.date >= week_ago),
+        "user_checkins": select(checkin.id, checkin.date, habit.description)
+            .join(habit, habit.id == checkin.habit_id)
+            .where(habit.owner_id == 1)
+            .order_by(checkin.date, checkin.id),
+        "global_map": select(checkin.id, checkin.latitude, checkin.longitude)
+            .where(*geo.bbox_clauses(checkin.latitude, checkin.longitude, (20.0, -160.0, 25.0, -150.0))),
+        "leaderboard_month": select(models.UserDailyScore.user_id, func.sum(models.UserDailyScore.score))
+            .where(models.UserDailyScore.day >= month_ago)
+            .group_by(models.UserDailyScore.user_id),
+    }
+
+
+def _seq_scans(plan):
+    found = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in GUARDED_TABLES:
+        found.append("seq scan on " + plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        found.extend(_seq_scans(child))
+    return found
+
+
+def _sorts(plan):
+    found = [plan["Node Type"]] if plan.get("Node Type") in SORT_NODES else []
+    for child in plan.get("Plans", []):
+        found.extend(_sorts(child))
+    return found
+
+
+# EXPLAIN each community query with seq scans discouraged; any guarded table
+# still read sequentially, or a sort on an index ordered query, means an index
+# the query relies on is missing or declared in the wrong order
+def check_query_plans(engine=db.engine):
+    if engine.dialect.name != "postgresql":
+        print(f"Skipping plan check, EXPLAIN output is only checked on postgresql (got {engine.dialect.name})")
+        return {}
+
+    failures = {}
+    with engine.connect() as conn:
+        for name, stmt in community_queries().items():
+            with conn.begin():
+                conn.execute(text("SET LOCAL enable_seqscan = off"))
+                sql = str(stmt.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+                plan = conn.execute(text("EXPLAIN (FORMAT JSON) " + sql)).scalar()[0]["Plan"]
+            problems = _seq_scans(plan)
+            if name in INDEX_ORDERED:
+                problems += [node.lower() for node in _sorts(plan)]
+            if problems:
+                failures[name] = problems
+            print(f"{name}: {', '.join(problems) if problems else 'ok'}")
+    return failures
+
+
+if __name__ == "__main__":
+    # python -m app.explain_check
+    sys.exit(1 if check_query_plans() else 0)
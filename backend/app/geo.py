@@ -0,0 +1,279 @@
+import math
+import os
+import re
+import sys
+
+from sqlalchemy import desc, func, or_, select, update
+
+from . import db, models
+
+# map query config
+MAP_CLUSTER_MAX_ZOOM = int(os.getenv("MAP_CLUSTER_MAX_ZOOM", "10"))  # below this zoom points are clustered
+MAP_CLUSTER_CELLS_PER_TILE = int(os.getenv("MAP_CLUSTER_CELLS_PER_TILE", "8"))  # ~32px cells on 256px tiles
+MAP_MAX_POINTS = int(os.getenv("MAP_MAX_POINTS", "5000"))
+
+# geohash cells stored per check-in, ~5m at precision 9
+GEOHASH_PRECISION = 9
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_PATTERN = re.compile(f"^[{GEOHASH_ALPHABET}]{{1,{GEOHASH_PRECISION}}}$")
+GEOHASH_BACKFILL_BATCH = int(os.getenv("GEOHASH_BACKFILL_BATCH", "1000"))
+
+# radius search config
+NEARBY_MAX_RADIUS_KM = float(os.getenv("NEARBY_MAX_RADIUS_KM", "500"))
+NEARBY_MAX_CANDIDATES = int(os.getenv("NEARBY_MAX_CANDIDATES", "20000"))  # newest rows kept from the bbox prefilter
+EARTH_RADIUS_KM = 6371
+
+
+def parse_bbox(min_lat, min_lon, max_lat, max_lon):
+    # either the whole viewport or none of it
+    values = (min_lat, min_lon, max_lat, max_lon)
+    if all(value is None for value in values):
+        return None
+    if any(value is None for value in values):
+        raise ValueError("min_lat, min_lon, max_lat and max_lon must be given together")
+    if min_lat > max_lat:
+        raise ValueError("min_lat must not be greater than max_lat")
+    return values
+
+
+def bbox_clauses(lat_col, lon_col, bbox):
+    clauses = [lat_col.isnot(None), lon_col.isnot(None)]
+    if bbox is None:
+        return clauses
+    min_lat, min_lon, max_lat, max_lon = bbox
+    clauses.append(lat_col.between(min_lat, max_lat))
+    if min_lon <= max_lon:
+        clauses.append(lon_col.between(min_lon, max_lon))
+    else:
+        # viewport crosses the antimeridian
+        clauses.append(or_(lon_col >= min_lon, lon_col <= max_lon))
+    return clauses
+
+
+# smallest bbox holding every point within radius_km of the center,
+# min_lon > max_lon when it crosses the antimeridian
+def radius_bbox(lat, lon, radius_km):
+    angle = radius_km / EARTH_RADIUS_KM
+    delta_lat = math.degrees(angle)
+    min_lat, max_lat = max(lat - delta_lat, -90.0), min(lat + delta_lat, 90.0)
+    if min_lat == -90.0 or max_lat == 90.0:
+        # the circle covers a pole, every longitude is in range
+        return min_lat, -180.0, max_lat, 180.0
+    delta_lon = math.degrees(math.asin(min(1.0, math.sin(angle) / math.cos(math.radians(lat)))))
+    if delta_lon >= 180.0:
+        return min_lat, -180.0, max_lat, 180.0
+    min_lon, max_lon = lon - delta_lon, lon + delta_lon
+    if min_lon < -180.0:
+        min_lon += 360.0
+    if max_lon > 180.0:
+        max_lon -= 360.0
+    return min_lat, min_lon, max_lat, max_lon
+
+
+def cluster_cell_degrees(zoom: int) -> float:
+    return 360.0 / (2 ** zoom * MAP_CLUSTER_CELLS_PER_TILE)
+
+
+def should_cluster(zoom) -> bool:
+    return zoom is not None and zoom < MAP_CLUSTER_MAX_ZOOM
+
+
+# grid cell of a point at the given cell size, shifted so indices are never negative
+def cell_columns(lat_col, lon_col, cell_deg: float):
+    return (
+        func.floor((lat_col + 90) / cell_deg).label("cell_row"),
+        func.floor((lon_col + 180) / cell_deg).label("cell_col"),
+    )
+
+
+def cluster_row_to_dict(row, cell_deg: float) -> dict:
+    south = row.cell_row * cell_deg - 90
+    west = row.cell_col * cell_deg - 180
+    return {
+        "cluster": True,
+        "count": row.count,
+        "impact_score": round(row.impact_score or 0.0, 1),
+        # centroid of the points so markers sit where the activity is
+        "latitude": row.latitude,
+        "longitude": row.longitude,
+        "bbox": [south, west, min(south + cell_deg, 90.0), min(west + cell_deg, 180.0)],
+    }
+
+
+# per grid cell counts, impact sums and centroids of the visible check-ins,
+# the busiest cells first when capped at limit
+def cluster_query(bbox, zoom: int, limit: int = None):
+    checkin = models.HabitCheckIn
+    cell_deg = cluster_cell_degrees(zoom)
+    cell_row, cell_col = cell_columns(checkin.latitude, checkin.longitude, cell_deg)
+    query = select(
+        cell_row,
+        cell_col,
+        func.count(checkin.id).label("count"),
+        func.sum(checkin.impact_score).label("impact_score"),
+        func.avg(checkin.latitude).label("latitude"),
+        func.avg(checkin.longitude).label("longitude"),
+    ).where(*bbox_clauses(checkin.latitude, checkin.longitude, bbox)).group_by(cell_row, cell_col)
+    if limit:
+        query = query.order_by(desc("count"), cell_row, cell_col).limit(limit)
+    return query, cell_deg
+
+
+# newest visible check-ins with their habit columns from the join
+def points_query(bbox, limit: int, since=None):
+    checkin = models.HabitCheckIn
+    query = select(
+        checkin.id,
+        checkin.latitude,
+        checkin.longitude,
+        checkin.date,
+        checkin.impact_score,
+        models.Habit.activity_type,
+        models.Habit.description,
+    ).join(models.Habit, models.Habit.id == checkin.habit_id).where(
+        *bbox_clauses(checkin.latitude, checkin.longitude, bbox)
+    ).order_by(desc(checkin.date), desc(checkin.id)).limit(limit)
+    return query.where(checkin.date >= since) if since else query
+
+
+def point_row_to_dict(row) -> dict:
+    return {
+        "id": row.id,
+        "latitude": row.latitude,
+        "longitude": row.longitude,
+        "activity_type": row.activity_type.value,
+        "description": row.description,
+        "date": row.date,
+        "impact_score": row.impact_score
+    }
+
+
+def encode_geohash(lat, lon, precision: int = GEOHASH_PRECISION):
+    if lat is None or lon is None:
+        return None
+    # interleave lon/lat bisection bits, 5 bits per character
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, value, bits, even = [], 0, 0, True
+    while len(chars) < precision:
+        interval, coord = (lon_range, lon) if even else (lat_range, lat)
+        mid = (interval[0] + interval[1]) / 2
+        if coord >= mid:
+            value = value * 2 + 1
+            interval[0] = mid
+        else:
+            value *= 2
+            interval[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            value, bits = 0, 0
+    return "".join(chars)
+
+
+def geohash_bbox(cell: str):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in cell:
+        value = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            interval = lon_range if even else lat_range
+            mid = (interval[0] + interval[1]) / 2
+            if value >> shift & 1:
+                interval[0] = mid
+            else:
+                interval[1] = mid
+            even = not even
+    return lat_range[0], lon_range[0], lat_range[1], lon_range[1]
+
+
+def valid_cell(cell: str) -> bool:
+    return bool(GEOHASH_PATTERN.match(cell or ""))
+
+
+def _cell_filters(within=None, since=None):
+    checkin = models.HabitCheckIn
+    clauses = [checkin.geohash.isnot(None)]
+    if within:
+        # prefix match on the geohash index, every finer cell shares its parent's prefix
+        clauses.append(checkin.geohash.like(within + "%"))
+    if since:
+        clauses.append(checkin.date >= since)
+    return clauses
+
+
+# check-in counts and impact sums per cell at the given resolution (geohash length)
+def cell_aggregate_query(resolution: int, within=None, since=None, limit: int = None):
+    checkin = models.HabitCheckIn
+    cell = func.substr(checkin.geohash, 1, resolution).label("cell")
+    query = select(
+        cell,
+        func.count(checkin.id).label("count"),
+        func.sum(checkin.impact_score).label("impact_score"),
+    ).where(*_cell_filters(within, since)).group_by(cell).order_by(desc("count"), cell)
+    return query.limit(limit) if limit else query
+
+
+def cell_row_to_dict(row) -> dict:
+    south, west, north, east = geohash_bbox(row.cell)
+    return {
+        "cell": row.cell,
+        "count": row.count,
+        "impact_score": round(row.impact_score or 0.0, 1),
+        "latitude": (south + north) / 2,
+        "longitude": (west + east) / 2,
+        "bbox": [south, west, north, east],
+    }
+
+
+# top users by impact inside one cell, for regional leaderboards
+def cell_leaderboard_query(cell: str, since=None, limit: int = 10):
+    checkin = models.HabitCheckIn
+    total = func.sum(checkin.impact_score).label("impact_score")
+    return select(
+        models.User.id.label("user_id"),
+        models.User.name,
+        total,
+        func.count(checkin.id).label("total_checkins"),
+    ).join(models.Habit, models.Habit.id == checkin.habit_id).join(
+        models.User, models.User.id == models.Habit.owner_id
+    ).where(*_cell_filters(cell, since)).group_by(models.User.id, models.User.name).order_by(
+        desc(total), models.User.id
+    ).limit(limit)
+
+
+# fill geohash for located check-ins written before the column existed
+def backfill_geohashes(session, batch_size: int = GEOHASH_BACKFILL_BATCH) -> int:
+    checkin = models.HabitCheckIn
+    filled, last_id = 0, 0
+    while True:
+        rows = session.execute(
+            select(checkin.id, checkin.latitude, checkin.longitude).where(
+                checkin.id > last_id,
+                checkin.geohash.is_(None),
+                checkin.latitude.isnot(None),
+                checkin.longitude.isnot(None),
+            ).order_by(checkin.id).limit(batch_size)
+        ).all()
+        if not rows:
+            return filled
+        session.execute(
+            update(checkin),
+            [{"id": row.id, "geohash": encode_geohash(row.latitude, row.longitude)} for row in rows],
+        )
+        session.commit()
+        filled += len(rows)
+        last_id = rows[-1].id
+        print(f"Backfilled {filled} check-in geohashes")
+
+
+if __name__ == "__main__":
+    # python -m app.geo backfill
+    if sys.argv[1:] != ["backfill"]:
+        print("usage: python -m app.geo backfill")
+        sys.exit(1)
+    session = db.SessionLocal()
+    try:
+        print(f"Filled {backfill_geohashes(session)} check-in geohashes")
+    finally:
+        session.close()
@@ -0,0 +1,175 @@
+import os
+import threading
+import time
+from datetime import date
+
+import numpy as np
+from sqlalchemy import select
+
+from . import geo, models
+
+# heatmap config
+HEATMAP_RESOLUTIONS = (4.0, 2.0, 1.0, 0.5, 0.25)  # grid steps in degrees, finest ~28km
+HEATMAP_CACHE_SECONDS = int(os.getenv("HEATMAP_CACHE_SECONDS", "300"))  # also slides week/month windows forward
+HEATMAP_FETCH_BATCH = int(os.getenv("HEATMAP_FETCH_BATCH", "10000"))
+
+
+def grid_shape(resolution: float):
+    return int(round(180 / resolution)), int(round(360 / resolution))
+
+
+def cell_indices(lats, lons, resolution: float):
+    rows, cols = grid_shape(resolution)
+    row = np.clip(((np.asarray(lats, dtype=float) + 90) / resolution).astype(np.int64), 0, rows - 1)
+    col = np.clip(((np.asarray(lons, dtype=float) + 180) / resolution).astype(np.int64), 0, cols - 1)
+    return row, col
+
+
+class DensityGrid:
+    """Global check-in counts and impact sums binned on a lat/lon grid, only occupied cells are stored."""
+
+    def __init__(self, resolution: float, cutoff=None):
+        self.resolution = resolution
+        self.cutoff = cutoff
+        self.rows, self.cols = grid_shape(resolution)
+        # sorted flat cell indices and their totals, a dense 0.25 degree grid would be ~1M cells per grid
+        self.cells = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.impact = np.zeros(0, dtype=np.float64)
+        self.built_at = time.time()
+
+    # vectorized binning of one batch of coordinates, a single check-in is the 1-element case
+    def add(self, lats, lons, impacts):
+        if not len(lats):
+            return
+        row, col = cell_indices(lats, lons, self.resolution)
+        cells, inverse = np.unique(row * self.cols + col, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(cells))
+        impact = np.bincount(inverse, weights=np.nan_to_num(np.asarray(impacts, dtype=float)), minlength=len(cells))
+
+        pos = np.searchsorted(self.cells, cells)
+        found = pos < len(self.cells)
+        found[found] = self.cells[pos[found]] == cells[found]
+        # occupied cells are bumped in place, only new cells grow the arrays
+        self.counts[pos[found]] += counts[found]
+        self.impact[pos[found]] += impact[found]
+        new = ~found
+        if new.any():
+            self.cells = np.insert(self.cells, pos[new], cells[new])
+            self.counts = np.insert(self.counts, pos[new], counts[new])
+            self.impact = np.insert(self.impact, pos[new], impact[new])
+
+    def window(self, bbox):
+        # row/col ranges covering the bbox, wrapping around the antimeridian when needed
+        if bbox is None:
+            bbox = (-90.0, -180.0, 90.0, 180.0)
+        min_lat, min_lon, max_lat, max_lon = bbox
+        (row_lo, row_hi), _ = cell_indices([min_lat, max_lat], [0, 0], self.resolution)
+        _, (col_lo, col_hi) = cell_indices([0, 0], [min_lon, max_lon], self.resolution)
+
+        rows, cols = np.divmod(self.cells, self.cols)
+        keep = (rows >= row_lo) & (rows <= row_hi)
+        if min_lon <= max_lon:
+            keep &= (cols >= col_lo) & (cols <= col_hi)
+            width = col_hi - col_lo + 1
+        else:
+            keep &= (cols >= col_lo) | (cols <= col_hi)
+            width = self.cols - col_lo + col_hi + 1
+        # window-relative positions, columns past the antimeridian continue after the eastern edge
+        rows = rows[keep] - row_lo
+        cols = (cols[keep] - col_lo) % self.cols
+        counts, impact = self.counts[keep], self.impact[keep]
+        order = np.lexsort((cols, rows))
+        return {
+            "resolution": self.resolution,
+            "origin": [row_lo * self.resolution - 90, col_lo * self.resolution - 180],
+            "rows": int(row_hi - row_lo + 1),
+            "cols": int(width),
+            "max_count": int(counts.max()) if counts.size else 0,
+            "cells": {
+                "row": rows[order].tolist(),
+                "col": cols[order].tolist(),
+                "count": counts[order].tolist(),
+                "impact": np.round(impact[order], 1).tolist(),
+            },
+        }
+
+
+class HeatmapCache:
+    """Density grids per (resolution, timeframe), new check-ins are binned into them in place."""
+
+    def __init__(self, ttl_seconds=HEATMAP_CACHE_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._grids = {}  # (resolution, timeframe) -> (expires_at, DensityGrid)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._grids.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._grids.pop(key, None)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, grid):
+        with self._lock:
+            self._grids[key] = (time.monotonic() + self.ttl_seconds, grid)
+
+    def add_point(self, lat, lon, impact, day=None):
+        if lat is None or lon is None:
+            return
+        day = day or date.today()
+        with self._lock:
+            for _, grid in self._grids.values():
+                if grid.cutoff is None or day >= grid.cutoff:
+                    grid.add([lat], [lon], [impact or 0.0])
+
+    def clear(self):
+        with self._lock:
+            self._grids.clear()
+
+    def stats(self):
+        with self._lock:
+            grids = [
+                {
+                    "resolution": resolution,
+                    "timeframe": timeframe,
+                    "checkins": int(grid.counts.sum()),
+                    "cells": len(grid.cells),
+                }
+                for (resolution, timeframe), (_, grid) in self._grids.items()
+            ]
+        return {"grids": grids, "hits": self.hits, "misses": self.misses, "ttl_seconds": self.ttl_seconds}
+
+
+heatmap_cache = HeatmapCache()
+
+
+async def build_grid(db, resolution: float, cutoff=None) -> DensityGrid:
+    checkin = models.HabitCheckIn
+    grid = DensityGrid(resolution, cutoff)
+    query = select(checkin.latitude, checkin.longitude, checkin.impact_score).where(
+        *geo.bbox_clauses(checkin.latitude, checkin.longitude, None)
+    )
+    if cutoff:
+        query = query.where(checkin.date >= cutoff)
+    # stream coordinates in batches so memory stays bounded by the grid, not the table
+    result = await db.stream(query.execution_options(yield_per=HEATMAP_FETCH_BATCH))
+    async for batch in result.partitions():
+        lats, lons, impacts = zip(*batch)
+        grid.add(lats, lons, [impact or 0.0 for impact in impacts])
+    return grid
+
+
+async def get_grid(db, resolution: float, timeframe: str, cutoff=None) -> DensityGrid:
+    key = (resolution, timeframe)
+    grid = heatmap_cache.get(key)
+    if grid is None:
+        # check-ins landing during the build are picked up again once the grid expires
+        grid = await build_grid(db, resolution, cutoff)
+        heatmap_cache.set(key, grid)
+    return grid
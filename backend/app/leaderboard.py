@@ -0,0 +1,143 @@
+import os
+import sys
+import threading
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import func, desc, insert
+from sqlalchemy.orm import Session
+
+from . import db, models, partitions
+from .db import upsert_add
+
+# leaderboard config
+LEADERBOARD_CACHE_SECONDS = int(os.getenv("LEADERBOARD_CACHE_SECONDS", "30"))
+LEADERBOARD_MAX_LIMIT = 100
+
+TIMEFRAME_DAYS = {"week": 7, "month": 30, "year": 365}
+
+_top_cache = {}  # (timeframe, limit) -> (expires_at, rows)
+_cache_lock = threading.Lock()
+
+
+def timeframe_cutoff(timeframe: str):
+    days = TIMEFRAME_DAYS.get(timeframe)
+    return date.today() - timedelta(days=days) if days else None
+
+
+def _add_to_bucket(db: Session, user_id: int, day: date, score: float, checkins: int):
+    upsert_add(db, models.UserDailyScore, {"user_id": user_id, "day": day}, {"score": score, "checkins": checkins})
+
+
+# bucket updates join the caller's transaction, the caller commits
+def record_checkin(db: Session, checkin: models.HabitCheckIn, habit: models.Habit):
+    _add_to_bucket(db, habit.owner_id, checkin.date, checkin.impact_score or 0.0, 1)
+
+
+def record_habit_deleted(db: Session, habit: models.Habit):
+    per_day = db.query(
+        models.HabitCheckIn.date,
+        func.coalesce(func.sum(models.HabitCheckIn.impact_score), 0.0),
+        func.count(models.HabitCheckIn.id),
+    ).filter(models.HabitCheckIn.habit_id == habit.id).group_by(models.HabitCheckIn.date)
+    for day, score, count in per_day:
+        _add_to_bucket(db, habit.owner_id, day, -score, -count)
+
+
+def _scores_query(db: Session, timeframe: str):
+    query = db.query(
+        models.UserDailyScore.user_id.label("user_id"),
+        func.sum(models.UserDailyScore.score).label("total_score"),
+        func.sum(models.UserDailyScore.checkins).label("total_checkins"),
+    )
+    cutoff = timeframe_cutoff(timeframe)
+    if cutoff:
+        query = query.filter(models.UserDailyScore.day >= cutoff)
+    return query.group_by(models.UserDailyScore.user_id).having(func.sum(models.UserDailyScore.checkins) > 0)
+
+
+def top_n(db: Session, timeframe: str = "month", limit: int = 10, use_cache: bool = True) -> list:
+    key = (timeframe, limit)
+    with _cache_lock:
+        cached = _top_cache.get(key)
+        if use_cache and cached and cached[0] > time.monotonic():
+            return cached[1]
+
+    # sum per user daily buckets rather than every check-in in the window
+    scores = _scores_query(db, timeframe).subquery()
+    rows = db.query(
+        models.User.name, scores.c.total_score, scores.c.total_checkins
+    ).join(scores, scores.c.user_id == models.User.id).order_by(
+        desc(scores.c.total_score), models.User.id
+    ).limit(limit).all()
+
+    leaderboard = [
+        {
+            "rank": idx + 1,
+            "name": name,
+            "impact_score": float(total_score),
+            "total_checkins": int(total_checkins)
+        }
+        for idx, (name, total_score, total_checkins) in enumerate(rows)
+    ]
+    now = time.monotonic()
+    with _cache_lock:
+        # drop expired entries so the cache only holds what's been asked for recently
+        for stale in [k for k, (expires_at, _) in _top_cache.items() if expires_at <= now]:
+            del _top_cache[stale]
+        _top_cache[key] = (now + LEADERBOARD_CACHE_SECONDS, leaderboard)
+    return leaderboard
+
+
+def user_rank(db: Session, user: models.User, timeframe: str = "month") -> dict:
+    scores = _scores_query(db, timeframe).subquery()
+    mine = db.query(scores.c.total_score, scores.c.total_checkins).filter(scores.c.user_id == user.id).first()
+    score, checkins = (float(mine[0]), int(mine[1])) if mine else (0.0, 0)
+    ahead = db.query(func.count()).select_from(scores).filter(scores.c.total_score > score).scalar()
+    return {
+        "rank": ahead + 1 if mine else None,
+        "name": user.name,
+        "impact_score": score,
+        "total_checkins": checkins,
+        "timeframe": timeframe,
+    }
+
+
+def invalidate():
+    with _cache_lock:
+        _top_cache.clear()
+
+
+# rebuild every bucket from the check-in table, buckets for days already
+# archived into monthly summaries have no detail rows left and are kept
+def rebuild(db: Session) -> int:
+    horizon = partitions.archive_horizon(db)
+    buckets = db.query(models.UserDailyScore)
+    per_day = db.query(
+        models.Habit.owner_id.label("user_id"),
+        models.HabitCheckIn.date.label("day"),
+        func.coalesce(func.sum(models.HabitCheckIn.impact_score), 0.0).label("score"),
+        func.count(models.HabitCheckIn.id).label("checkins"),
+    ).join(models.Habit, models.Habit.id == models.HabitCheckIn.habit_id)
+    if horizon:
+        buckets = buckets.filter(models.UserDailyScore.day >= horizon)
+        per_day = per_day.filter(models.HabitCheckIn.date >= horizon)
+    buckets.delete(synchronize_session=False)
+    rows = per_day.group_by(models.Habit.owner_id, models.HabitCheckIn.date).all()
+    if rows:
+        db.execute(insert(models.UserDailyScore), [dict(row._mapping) for row in rows])
+    db.commit()
+    invalidate()
+    return len(rows)
+
+
+if __name__ == "__main__":
+    # python -m app.leaderboard rebuild
+    if sys.argv[1:] != ["rebuild"]:
+        print("usage: python -m app.leaderboard rebuild")
+        sys.exit(1)
+    session = db.SessionLocal()
+    try:
+        print(f"Rebuilt {rebuild(session)} daily score buckets")
+    finally:
+        session.close()
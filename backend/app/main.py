@@ -1,16 +1,22 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Body
+from fastapi import FastAPI, Depends, HTTPException, status, Body, Query, Response
+from fastapi.responses import StreamingResponse, JSONResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
-from typing import List
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from sqlalchemy import select, desc, tuple_
+from typing import List, Optional
+import asyncio
 import json
-from datetime import date, datetime, timedelta
+from datetime import date
 
-from app import models, db, auth, schemas
-from app.db import get_db
+from app import models, db, auth, schemas, stats, counters, leaderboard, partitions, geo, tiles, heatmap
+from app.db import get_async_db, get_read_db
 from app.schemas import HabitCheckInCreate 
-from app.ocean_data import fetch_marine_data
+from app.ocean_data import fetch_marine_data, close_marine_client, get_single_flight_stats, get_ocean_index, get_distances
+from app.marine_cache import marine_cache, water_mask
+from app.enrichment import enrichment_queue, STATUS_PENDING, STATUS_COMPLETE
+from app.snapshots import save_marine_snapshots, snapshot_to_dict
 from app.models import ActivityType
 
 app = FastAPI()
@@ -25,10 +31,31 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"], 
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Map-Truncated"],
 )
 
-# create all tables 
-models.Base.metadata.create_all(bind=db.engine)
+CHECKIN_PAGE_MAX = 1000
+
+background_tasks = []
+
+# background marine enrichment workers, stats refresh and partition upkeep
+@app.on_event("startup")
+async def start_enrichment_workers():
+    get_ocean_index()  # build the nearest-ocean index once up front
+    await enrichment_queue.start()
+    background_tasks.append(asyncio.create_task(stats.community_stats_refresher()))
+    if partitions.CHECKIN_PARTITIONING or partitions.CHECKIN_RETENTION_MONTHS:
+        background_tasks.append(asyncio.create_task(partitions.partition_maintainer()))
+
+# release pooled marine api connections
+@app.on_event("shutdown")
+async def shutdown_marine_client():
+    for task in background_tasks:
+        task.cancel()
+    await enrichment_queue.stop()
+    await close_marine_client()
+    water_mask.save()
+    await db.async_engine.dispose()
 
 @app.get("/")
 def read_root():
@@ -36,8 +63,8 @@ def read_root():
 
 # login and access token
 @app.post("/token")
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = auth.authenticate_user(db, form_data.username, form_data.password)
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = await auth.authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect email or password")
     access_token = auth.create_access_token(data={"sub": user.email})
@@ -45,17 +72,19 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
 
 #for user sign up
 @app.post("/users/signup", status_code=status.HTTP_201_CREATED)
-def signup(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def signup(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
     try:
-        existing_user = db.query(models.User).filter(models.User.email == user.email).first()
+        existing_user = await auth.get_user_by_email(db, user.email)
         if existing_user:
             raise HTTPException(status_code=400, detail="Email already registered")
 
-        hashed_password = auth.get_password_hash(user.password)
+        hashed_password = await asyncio.to_thread(auth.get_password_hash, user.password)
         new_user = models.User(email=user.email, hashed_password=hashed_password, name=user.name)
         db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
+        # sync helpers run on the async session's connection via run_sync
+        await db.run_sync(counters.record_signup)
+        await db.commit()
+        await db.refresh(new_user)
         return {"id": new_user.id, "email": new_user.email, "name": new_user.name}
     except Exception as e:
         print("Signup error:", e)
@@ -63,168 +92,312 @@ def signup(user: schemas.UserCreate, db: Session = Depends(get_db)):
 
 # for creating the users habits
 @app.post("/habits/", response_model=schemas.Habit)
-def create_habit(habit: schemas.HabitCreate, current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
+async def create_habit(habit: schemas.HabitCreate, current_user: models.User = Depends(auth.get_current_user), db: AsyncSession = Depends(get_async_db)):
     try:
         print(f"Creating habit with description: {habit.description}")
         new_habit = models.Habit(description=habit.description, owner_id=current_user.id)
         db.add(new_habit)
-        db.commit()
-        db.refresh(new_habit)
+        await db.commit()
+        await db.refresh(new_habit, ["checkins"])
         print(f"Successfully created habit with ID: {new_habit.id}")
         return new_habit
     except Exception as e:
         print(f"Error creating habit: {e}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail="Failed to create habit")
 
 # read current user habits
 @app.get("/habits/", response_model=List[schemas.Habit])
-def read_habits(current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
-    habits = db.query(models.Habit).filter(models.Habit.owner_id == current_user.id).all()
-    return habits
+async def read_habits(current_user: models.User = Depends(auth.get_current_user), db: AsyncSession = Depends(get_async_db)):
+    habits = await db.execute(
+        select(models.Habit).where(models.Habit.owner_id == current_user.id).options(selectinload(models.Habit.checkins))
+    )
+    return habits.scalars().all()
 
-#update habit
-@app.put("/habits/{habit_id}", response_model=schemas.Habit)
-def update_habit(habit_id: int, habit_update: schemas.HabitCreate, current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
-    habit = db.query(models.Habit).filter(models.Habit.id == habit_id, models.Habit.owner_id == current_user.id).first()
+async def get_owned_habit(db: AsyncSession, habit_id: int, user_id: int, *options) -> models.Habit:
+    habit = (await db.execute(
+        select(models.Habit).where(models.Habit.id == habit_id, models.Habit.owner_id == user_id).options(*options)
+    )).scalars().first()
     if not habit:
         raise HTTPException(status_code=404, detail="Habit not found")
+    return habit
+
+#update habit
+@app.put("/habits/{habit_id}", response_model=schemas.Habit)
+async def update_habit(habit_id: int, habit_update: schemas.HabitCreate, current_user: models.User = Depends(auth.get_current_user), db: AsyncSession = Depends(get_async_db)):
+    habit = await get_owned_habit(db, habit_id, current_user.id, selectinload(models.Habit.checkins))
     habit.description = habit_update.description
-    db.commit()
-    db.refresh(habit)
+    await db.commit()
     return habit
 
 #delete habit
 @app.delete("/habits/{habit_id}")
-def delete_habit(habit_id: int, current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
-    habit = db.query(models.Habit).filter(models.Habit.id == habit_id, models.Habit.owner_id == current_user.id).first()
-    if not habit:
-        raise HTTPException(status_code=404, detail="Habit not found")
-    db.delete(habit)
-    db.commit()
+async def delete_habit(habit_id: int, current_user: models.User = Depends(auth.get_current_user), db: AsyncSession = Depends(get_async_db)):
+    habit = await get_owned_habit(db, habit_id, current_user.id)
+    located = (await db.execute(
+        select(models.HabitCheckIn.latitude, models.HabitCheckIn.longitude).where(
+            models.HabitCheckIn.habit_id == habit.id, models.HabitCheckIn.latitude.isnot(None)
+        )
+    )).all()
+    await db.run_sync(counters.record_habit_deleted, habit)
+    await db.run_sync(leaderboard.record_habit_deleted, habit)
+    await db.delete(habit)
+    await db.commit()
+    for lat, lon in located:
+        tiles.tile_cache.invalidate_point(lat, lon)
+    if located:
+        heatmap.heatmap_cache.clear()
     return {"message": "Habit deleted"}
 
 #habit check in
 @app.post("/habits/{habit_id}/checkin")
-def checkin_habit(
+async def checkin_habit(
    habit_id: int, 
     checkin_data: HabitCheckInCreate = Body(...),
+    background_enrichment: bool = False,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)):
+    db: AsyncSession = Depends(get_async_db)):
     
     print(f"Checking in habit {habit_id} with location: {checkin_data.latitude}, {checkin_data.longitude}")
     
-    habit = db.query(models.Habit).filter_by(id=habit_id, owner_id=current_user.id).first()
-    if not habit:
-        raise HTTPException(status_code=404, detail="Habit not found")
+    habit = await get_owned_habit(db, habit_id, current_user.id)
 
+    has_location = checkin_data.latitude is not None and checkin_data.longitude is not None
     checkin = models.HabitCheckIn(
         habit_id=habit.id, 
         date=date.today(),
         latitude=checkin_data.latitude,
         longitude=checkin_data.longitude,
+        geohash=geo.encode_geohash(checkin_data.latitude, checkin_data.longitude),
+        marine_status=STATUS_PENDING if background_enrichment and has_location else None,
     )
     db.add(checkin)
-    db.commit()
-    db.refresh(checkin)
+    await db.flush()
+    # running totals move in the same transaction as the insert
+    await db.run_sync(counters.record_checkin, checkin, habit)
+    await db.run_sync(leaderboard.record_checkin, checkin, habit)
+    await db.commit()
+    tiles.tile_cache.invalidate_point(checkin.latitude, checkin.longitude)
+    heatmap.heatmap_cache.add_point(checkin.latitude, checkin.longitude, checkin.impact_score, checkin.date)
+
+    # respond right after the insert and let the workers fill in marine data
+    if background_enrichment:
+        if has_location:
+            enrichment_queue.submit(checkin.id, checkin.latitude, checkin.longitude)
+        return {
+            "message": "Check-in recorded",
+            "id": checkin.id,
+            "date": checkin.date,
+            "latitude": checkin.latitude,
+            "longitude": checkin.longitude,
+            "marine_status": checkin.marine_status,
+            "marine_data": None,
+        }
 
-    marine_data = fetch_marine_data(lat=checkin.latitude, lon=checkin.longitude) 
+    marine_data = await fetch_marine_data(lat=checkin.latitude, lon=checkin.longitude)
+    if marine_data:
+        await db.run_sync(save_marine_snapshots, [(checkin.id, marine_data)], status=STATUS_COMPLETE)
 
     return {
         "message": "Check-in recorded",
+        "id": checkin.id,
         "date": checkin.date,
-        "marine_data": marine_data,
         "latitude": checkin.latitude,
         "longitude": checkin.longitude,
         "marine_data": marine_data,
     }
 
+async def get_owned_checkin(db: AsyncSession, checkin_id: int, user_id: int) -> models.HabitCheckIn:
+    checkin = (await db.execute(
+        select(models.HabitCheckIn).join(models.Habit).where(
+            models.HabitCheckIn.id == checkin_id,
+            models.Habit.owner_id == user_id
+        ).options(selectinload(models.HabitCheckIn.marine_snapshot))
+    )).scalars().first()
+    if not checkin:
+        raise HTTPException(status_code=404, detail="Check-in not found")
+    return checkin
+
+def marine_payload(checkin: models.HabitCheckIn) -> dict:
+    return {
+        "checkin_id": checkin.id,
+        "marine_status": checkin.marine_status,
+        "marine_data": snapshot_to_dict(checkin.marine_snapshot, checkin.latitude, checkin.longitude),
+    }
+
+#poll background marine enrichment
+@app.get("/habits/checkins/{checkin_id}/marine")
+async def get_checkin_marine_data(checkin_id: int, current_user: models.User = Depends(auth.get_current_user), db: AsyncSession = Depends(get_async_db)):
+    return marine_payload(await get_owned_checkin(db, checkin_id, current_user.id))
+
+#push marine enrichment as a server-sent event once it lands
+@app.get("/habits/checkins/{checkin_id}/marine/stream")
+async def stream_checkin_marine_data(checkin_id: int, timeout: float = 30.0, current_user: models.User = Depends(auth.get_current_user), db: AsyncSession = Depends(get_async_db)):
+    checkin = await get_owned_checkin(db, checkin_id, current_user.id)
+
+    async def events():
+        if checkin.marine_status == STATUS_PENDING:
+            enrichment_queue.waiter(checkin_id)
+            # the snapshot may have been written between loading the check-in and registering
+            await db.refresh(checkin, ["marine_status"])
+            if checkin.marine_status == STATUS_PENDING:
+                await enrichment_queue.wait_for(checkin_id, timeout=min(timeout, 120.0))
+            await db.refresh(checkin, ["marine_status", "marine_snapshot"])
+        yield f"event: marine\ndata: {json.dumps(marine_payload(checkin), default=str)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+# keyset cursors are "<date>_<id>" of the last row on the page
+def encode_cursor(checkin_date: date, checkin_id: int) -> str:
+    return f"{checkin_date.isoformat()}_{checkin_id}"
+
+def decode_cursor(cursor: str):
+    try:
+        cursor_date, cursor_id = cursor.split("_")
+        return date.fromisoformat(cursor_date), int(cursor_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+# "[row,row,...]" written one yield_per batch at a time
+async def json_array(rows):
+    yield "["
+    separator = ""
+    async for batch in rows.partitions():
+        yield separator + ",".join(json.dumps(dict(row._mapping), default=str) for row in batch)
+        separator = ","
+    yield "]"
+
 #get habit check ins
 @app.get("/habits/checkins/", response_model=List[schemas.HabitCheckIn])
-def get_all_checkins(current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
-    habits = db.query(models.Habit).filter(models.Habit.owner_id == current_user.id).all()
-    checkins = []
-    for habit in habits:
-        for checkin in habit.checkins:
-            checkin.habit_description = habit.description
-            checkins.append(checkin)
-    
+async def get_all_checkins(
+    response: Response,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=CHECKIN_PAGE_MAX),
+    current_user: models.User = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)):
+
+    # one joined projection instead of loading each habit's checkins
+    query = select(
+        models.HabitCheckIn.id,
+        models.HabitCheckIn.date,
+        models.HabitCheckIn.habit_id,
+        models.HabitCheckIn.latitude,
+        models.HabitCheckIn.longitude,
+        models.Habit.description.label("habit_description"),
+        models.HabitCheckIn.marine_status,
+        models.MarineSnapshot.wave_height,
+        models.MarineSnapshot.sea_surface_temperature,
+        models.MarineSnapshot.wind_speed_10m,
+    ).join(
+        models.Habit, models.Habit.id == models.HabitCheckIn.habit_id
+    ).outerjoin(
+        models.MarineSnapshot, models.MarineSnapshot.checkin_id == models.HabitCheckIn.id
+    ).where(models.Habit.owner_id == current_user.id)
+
+    if start_date:
+        query = query.where(models.HabitCheckIn.date >= start_date)
+    if end_date:
+        query = query.where(models.HabitCheckIn.date <= end_date)
+    if cursor:
+        query = query.where(tuple_(models.HabitCheckIn.date, models.HabitCheckIn.id) > decode_cursor(cursor))
+
+    query = query.order_by(models.HabitCheckIn.date, models.HabitCheckIn.id)
+    rows = await db.stream(query.limit(limit).execution_options(yield_per=500))
+    if not limit:
+        # unpaged history goes out as a streamed JSON array, never all in memory at once
+        return StreamingResponse(json_array(rows), media_type="application/json")
+
+    checkins = [dict(row._mapping) async for row in rows]
+    if len(checkins) == limit:
+        last = checkins[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last["date"], last["id"])
     return checkins
 
 #get ocean data
 @app.get("/ocean-data/")
-def get_ocean_data():
-    return fetch_marine_data()
+async def get_ocean_data():
+    return await fetch_marine_data()
 
-#get community stats
-@app.get("/community/stats")
-def get_community_stats(db: Session = Depends(get_db)):
-    
-    # total user
-    total_users = db.query(models.User).count()
-    
-    # total check ins
-    total_checkins = db.query(models.HabitCheckIn).count()
-    
-    # total score
-    total_impact = db.query(func.sum(models.HabitCheckIn.impact_score)).scalar() or 0
-    
-    # activity break down
-    activity_stats = db.query(
-        models.Habit.activity_type,
-        func.count(models.HabitCheckIn.id).label('count')
-    ).join(models.HabitCheckIn).group_by(models.Habit.activity_type).all()
-    
-    activity_breakdown = {
-        activity.value: count for activity, count in activity_stats
-    }
-    
-    # week activity
-    week_ago = date.today() - timedelta(days=7)
-    recent_checkins = db.query(models.HabitCheckIn).filter(
-        models.HabitCheckIn.date >= week_ago
-    ).count()
-    
-    # top contributors this month
-    month_ago = date.today() - timedelta(days=30)
-    top_contributors = db.query(
-        models.User.name,
-        func.sum(models.HabitCheckIn.impact_score).label('monthly_score')
-    ).join(models.Habit).join(models.HabitCheckIn).filter(
-        models.HabitCheckIn.date >= month_ago
-    ).group_by(models.User.id, models.User.name).order_by(
-        desc('monthly_score')
-    ).limit(5).all()
-    
+#marine cache and request coalescing counters
+@app.get("/ocean-data/stats")
+def get_ocean_data_stats():
     return {
-        "total_users": total_users,
-        "total_checkins": total_checkins,
-        "total_impact_score": round(total_impact, 1),
-        "activity_breakdown": activity_breakdown,
-        "recent_weekly_checkins": recent_checkins,
-        "top_contributors": [
-            {"name": name, "impact_score": float(score)} 
-            for name, score in top_contributors
-        ]
+        "cache": marine_cache.stats(),
+        "single_flight": get_single_flight_stats(),
+        "enrichment": enrichment_queue.queue_stats(),
+        "water_mask": water_mask.stats(),
     }
 
+#connection pool usage, waits and QueuePool timeouts
+@app.get("/db/stats")
+def get_db_stats():
+    return db.pool_stats()
+
+#database health check
+@app.get("/health/db")
+async def get_db_health(response: Response):
+    try:
+        result = await db.check_database()
+    except Exception as e:
+        print("Database health check failed:", repr(e))
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"status": "unavailable", "error": repr(e), "pool": db.pool_stats()["async"]}
+    return {"status": "ok", **result, "pool": db.pool_stats()["async"]}
+
+#get community stats
+@app.get("/community/stats")
+async def get_community_stats(
+    live: bool = False,
+    max_age_seconds: int = Query(stats.COMMUNITY_STATS_MAX_AGE_SECONDS, ge=0),
+    read_db: AsyncSession = Depends(get_read_db),
+    db: AsyncSession = Depends(get_async_db)):
+    # served from the community_stats snapshot unless it's older than max_age_seconds,
+    # the snapshot is read from the replica and only a refresh writes to the primary
+    if not live:
+        snapshot = await read_db.run_sync(stats.read_community_stats, max_age_seconds)
+        if snapshot:
+            return snapshot
+    return await db.run_sync(stats.refresh_community_stats)
+
 #recent check ins
 @app.get("/community/recent-activity")
-def get_recent_community_activity(limit: int = 20, db: Session = Depends(get_db)):
+async def get_recent_community_activity(
+    response: Response,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db)):
+
+    # pull exactly the feed columns in one round trip
+    query = select(
+        models.HabitCheckIn.id,
+        models.HabitCheckIn.date,
+        models.HabitCheckIn.impact_score,
+        models.HabitCheckIn.latitude,
+        models.HabitCheckIn.longitude,
+        models.Habit.activity_type,
+        models.Habit.description,
+        models.User.name.label("user_name"),
+    ).join(
+        models.Habit, models.Habit.id == models.HabitCheckIn.habit_id
+    ).join(
+        models.User, models.User.id == models.Habit.owner_id
+    )
+    if cursor:
+        query = query.where(tuple_(models.HabitCheckIn.date, models.HabitCheckIn.id) < decode_cursor(cursor))
+
+    recent_checkins = (await db.execute(query.order_by(
+        desc(models.HabitCheckIn.date), desc(models.HabitCheckIn.id)
+    ).limit(limit))).all()
 
-    recent_checkins = db.query(models.HabitCheckIn).join(
-        models.Habit
-    ).join(models.User).order_by(
-        desc(models.HabitCheckIn.date)
-    ).limit(limit).all()
-    
     activity_feed = []
     for checkin in recent_checkins:
         activity_feed.append({
             "id": checkin.id,
-            "user_name": checkin.habit.owner.name,
-            "activity_type": checkin.habit.activity_type.value,
-            "description": checkin.habit.description,
+            "user_name": checkin.user_name,
+            "activity_type": checkin.activity_type.value,
+            "description": checkin.description,
             "date": checkin.date,
             "impact_score": checkin.impact_score,
             "location": {
@@ -232,66 +405,172 @@ def get_recent_community_activity(limit: int = 20, db: Session = Depends(get_db)
                 "longitude": checkin.longitude
             } if checkin.latitude and checkin.longitude else None
         })
-    
+
+    # "load more" continues from the last row of this page
+    if len(recent_checkins) == limit:
+        last = recent_checkins[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last.date, last.id)
+
     return activity_feed
 
-#get all check ins globally
+#located check ins in a viewport, clustered when zoomed out
 @app.get("/community/global-map")
-def get_global_activity_map(db: Session = Depends(get_db)):
-    checkins_with_location = db.query(models.HabitCheckIn).filter(
-        models.HabitCheckIn.latitude.isnot(None),
-        models.HabitCheckIn.longitude.isnot(None)
-    ).join(models.Habit).all()
-    
-    map_data = []
-    for checkin in checkins_with_location:
-        map_data.append({
-            "id": checkin.id,
-            "latitude": checkin.latitude,
-            "longitude": checkin.longitude,
-            "activity_type": checkin.habit.activity_type.value,
-            "description": checkin.habit.description,
-            "date": checkin.date,
-            "impact_score": checkin.impact_score
-        })
-    
-    return map_data
+async def get_global_activity_map(
+    response: Response,
+    min_lat: Optional[float] = Query(None, ge=-90, le=90),
+    min_lon: Optional[float] = Query(None, ge=-180, le=180),
+    max_lat: Optional[float] = Query(None, ge=-90, le=90),
+    max_lon: Optional[float] = Query(None, ge=-180, le=180),
+    zoom: Optional[int] = Query(None, ge=0, le=22),
+    limit: int = Query(geo.MAP_MAX_POINTS, ge=1, le=geo.MAP_MAX_POINTS),
+    db: AsyncSession = Depends(get_read_db)):
 
-#get leaderboard depending on time
-@app.get("/community/leaderboard")
-def get_community_leaderboard(timeframe: str = "month", db: Session = Depends(get_db)):
-    if timeframe == "week":
-        cutoff_date = date.today() - timedelta(days=7)
-    elif timeframe == "month":
-        cutoff_date = date.today() - timedelta(days=30)
-    elif timeframe == "year":
-        cutoff_date = date.today() - timedelta(days=365)
+    try:
+        bbox = geo.parse_bbox(min_lat, min_lon, max_lat, max_lon)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # range filters on the partial (latitude, longitude) index
+    if geo.should_cluster(zoom):
+        # small cells over a large viewport can outnumber the points, the busiest cells win
+        query, cell_deg = geo.cluster_query(bbox, zoom, limit)
+        map_data = [geo.cluster_row_to_dict(row, cell_deg) for row in (await db.execute(query)).all()]
     else:
-        cutoff_date = date(2020, 1, 1) 
-    
-    leaderboard = db.query(
-        models.User.name,
-        func.sum(models.HabitCheckIn.impact_score).label('total_score'),
-        func.count(models.HabitCheckIn.id).label('total_checkins')
-    ).join(models.Habit).join(models.HabitCheckIn).filter(
-        models.HabitCheckIn.date >= cutoff_date
-    ).group_by(models.User.id, models.User.name).order_by(
-        desc('total_score')
-    ).limit(10).all()
-    
+        # habit columns come from the join, no per-row lazy load
+        map_data = [geo.point_row_to_dict(row) for row in (await db.execute(geo.points_query(bbox, limit))).all()]
+
+    # most recent points or busiest clusters win when the viewport holds more than the limit
+    if len(map_data) == limit:
+        response.headers["X-Map-Truncated"] = "true"
+    return map_data
+
+#check ins within radius_km of a point, nearest first
+@app.get("/community/nearby")
+async def get_nearby_activity(
+    response: Response,
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radius_km: float = Query(10.0, gt=0, le=geo.NEARBY_MAX_RADIUS_KM),
+    timeframe: str = Query("all", pattern="^(week|month|year|all)$"),
+    limit: int = Query(100, ge=1, le=geo.MAP_MAX_POINTS),
+    db: AsyncSession = Depends(get_read_db)):
+
+    # bbox prefilter on the (latitude, longitude) index, then exact haversine on the candidates
+    query = geo.points_query(
+        geo.radius_bbox(lat, lon, radius_km), geo.NEARBY_MAX_CANDIDATES, leaderboard.timeframe_cutoff(timeframe)
+    )
+    rows = (await db.execute(query)).all()
+    if len(rows) == geo.NEARBY_MAX_CANDIDATES:
+        # only the newest candidates were measured
+        response.headers["X-Map-Truncated"] = "true"
+    if not rows:
+        return []
+    distances = get_distances([lat], [lon], [row.latitude for row in rows], [row.longitude for row in rows])[0]
+    nearby = sorted(
+        ((distance, row) for distance, row in zip(distances.tolist(), rows) if distance <= radius_km),
+        key=lambda pair: pair[0],
+    )[:limit]
+    return [{**geo.point_row_to_dict(row), "distance_km": round(distance, 3)} for distance, row in nearby]
+
+#map tile cache counters
+@app.get("/community/tiles/stats")
+def get_tile_stats():
+    return tiles.tile_cache.stats()
+
+#pre-aggregated activity tile, clusters below geo.MAP_CLUSTER_MAX_ZOOM and points above
+@app.get("/community/tiles/{z}/{x}/{y}")
+async def get_activity_tile(
+    z: int,
+    x: int,
+    y: int,
+    format: str = Query("json", pattern="^(json|bin)$"),
+    db: AsyncSession = Depends(get_read_db)):
+    if not tiles.valid_tile(z, x, y):
+        raise HTTPException(status_code=404, detail="Tile not found")
+    tile = await tiles.get_tile(db, z, x, y)
+    headers = {"Cache-Control": f"public, max-age={tiles.TILE_HTTP_MAX_AGE}"}
+    if format == "bin":
+        return Response(tiles.encode_binary(tile), media_type="application/octet-stream", headers=headers)
+    return JSONResponse(tiles.encode_json(tile, z, x, y), headers=headers)
+
+#check in counts and impact per geohash cell, coarser cells for lower resolutions
+@app.get("/community/cells")
+async def get_activity_cells(
+    resolution: int = Query(5, ge=1, le=geo.GEOHASH_PRECISION),
+    within: Optional[str] = None,
+    timeframe: str = Query("all", pattern="^(week|month|year|all)$"),
+    limit: int = Query(500, ge=1, le=geo.MAP_MAX_POINTS),
+    db: AsyncSession = Depends(get_read_db)):
+    if within and not geo.valid_cell(within):
+        raise HTTPException(status_code=400, detail="Invalid cell")
+    # a cell finer than the requested resolution can't hold whole cells of it
+    if within and len(within) > resolution:
+        raise HTTPException(status_code=400, detail="within must not be longer than resolution")
+    query = geo.cell_aggregate_query(resolution, within, leaderboard.timeframe_cutoff(timeframe), limit)
+    return [geo.cell_row_to_dict(row) for row in (await db.execute(query)).all()]
+
+#heatmap grid counters
+@app.get("/community/heatmap/stats")
+def get_heatmap_stats():
+    return heatmap.heatmap_cache.stats()
+
+#binned check in density (counts and impact) for a viewport, cells listed sparsely
+@app.get("/community/heatmap")
+async def get_activity_heatmap(
+    min_lat: Optional[float] = Query(None, ge=-90, le=90),
+    min_lon: Optional[float] = Query(None, ge=-180, le=180),
+    max_lat: Optional[float] = Query(None, ge=-90, le=90),
+    max_lon: Optional[float] = Query(None, ge=-180, le=180),
+    resolution: float = 1.0,
+    timeframe: str = Query("all", pattern="^(week|month|year|all)$"),
+    db: AsyncSession = Depends(get_read_db)):
+    try:
+        bbox = geo.parse_bbox(min_lat, min_lon, max_lat, max_lon)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if resolution not in heatmap.HEATMAP_RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"resolution must be one of {list(heatmap.HEATMAP_RESOLUTIONS)}")
+    grid = await heatmap.get_grid(db, resolution, timeframe, leaderboard.timeframe_cutoff(timeframe))
+    return {"timeframe": timeframe, **grid.window(bbox)}
+
+#top contributors inside one geohash cell
+@app.get("/community/leaderboard/region/{cell}")
+async def get_regional_leaderboard(
+    cell: str,
+    timeframe: str = Query("month", pattern="^(week|month|year|all)$"),
+    limit: int = Query(10, ge=1, le=leaderboard.LEADERBOARD_MAX_LIMIT),
+    db: AsyncSession = Depends(get_read_db)):
+    if not geo.valid_cell(cell):
+        raise HTTPException(status_code=400, detail="Invalid cell")
+    rows = (await db.execute(geo.cell_leaderboard_query(cell, leaderboard.timeframe_cutoff(timeframe), limit))).all()
     return [
         {
             "rank": idx + 1,
-            "name": name,
-            "impact_score": float(total_score),
-            "total_checkins": total_checkins
+            "name": row.name,
+            "impact_score": float(row.impact_score or 0.0),
+            "total_checkins": row.total_checkins,
         }
-        for idx, (name, total_score, total_checkins) in enumerate(leaderboard)
+        for idx, row in enumerate(rows)
     ]
 
+#get leaderboard depending on time
+@app.get("/community/leaderboard")
+async def get_community_leaderboard(
+    timeframe: str = Query("month", pattern="^(week|month|year|all)$"),
+    limit: int = Query(10, ge=1, le=leaderboard.LEADERBOARD_MAX_LIMIT),
+    db: AsyncSession = Depends(get_read_db)):
+    return await db.run_sync(leaderboard.top_n, timeframe, limit)
+
+#rank of any user for a timeframe
+@app.get("/community/leaderboard/rank/{user_id}")
+async def get_leaderboard_rank(user_id: int, timeframe: str = Query("month", pattern="^(week|month|year|all)$"), db: AsyncSession = Depends(get_read_db)):
+    user = await db.get(models.User, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return await db.run_sync(leaderboard.user_rank, user, timeframe)
+
 # update habits to include the type of activty
 @app.post("/habits/", response_model=schemas.Habit)
-def create_habit(habit: schemas.HabitCreate, current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
+async def create_habit(habit: schemas.HabitCreate, current_user: models.User = Depends(auth.get_current_user), db: AsyncSession = Depends(get_async_db)):
     try:
         print(f"Creating habit with description: {habit.description}")
         
@@ -306,13 +585,13 @@ def create_habit(habit: schemas.HabitCreate, current_user: models.User = Depends
             impact_score=impact_score
         )
         db.add(new_habit)
-        db.commit()
-        db.refresh(new_habit)
+        await db.commit()
+        await db.refresh(new_habit, ["checkins"])
         print(f"Successfully created habit with ID: {new_habit.id}")
         return new_habit
     except Exception as e:
         print(f"Error creating habit: {e}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail="Failed to create habit")
 
 #matching keywords for the activity
@@ -0,0 +1,185 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+# cache config
+MARINE_CACHE_GRID_DEG = float(os.getenv("MARINE_CACHE_GRID_DEG", "0.05"))  # ~5km cells
+MARINE_CACHE_TTL_SECONDS = int(os.getenv("MARINE_CACHE_TTL_SECONDS", "3600"))
+MARINE_CACHE_MAX_BYTES = int(os.getenv("MARINE_CACHE_MAX_BYTES", str(2 * 1024 * 1024)))
+
+# land/water verdict config
+WATER_MASK_GRID_DEG = float(os.getenv("WATER_MASK_GRID_DEG", "0.05"))
+WATER_MASK_MAX_CELLS = int(os.getenv("WATER_MASK_MAX_CELLS", "200000"))
+WATER_MASK_PATH = os.getenv("WATER_MASK_PATH")  # optional json file kept across restarts
+WATER_MASK_LAND_CONFIRMATIONS = int(os.getenv("WATER_MASK_LAND_CONFIRMATIONS", "3"))
+WATER_MASK_LAND_TTL_SECONDS = int(os.getenv("WATER_MASK_LAND_TTL_SECONDS", str(7 * 86400)))
+
+
+def snap_to_grid(lat, lon, step=MARINE_CACHE_GRID_DEG):
+    return round(round(lat / step) * step, 6), round(round(lon / step) * step, 6)
+
+
+class MarineCache:
+    """TTL + LRU cache of processed marine data keyed by (grid cell, forecast hour)."""
+
+    def __init__(self, grid_deg=MARINE_CACHE_GRID_DEG, ttl_seconds=MARINE_CACHE_TTL_SECONDS,
+                 max_bytes=MARINE_CACHE_MAX_BYTES):
+        self.grid_deg = grid_deg
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def make_key(self, lat, lon, now=None):
+        cell_lat, cell_lon = snap_to_grid(lat, lon, self.grid_deg)
+        hour = (now or datetime.utcnow()).strftime("%Y-%m-%dT%H")
+        return cell_lat, cell_lon, hour
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, size, value = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, size, value)
+            self._size += size
+            # evict least recently used until under the memory cap
+            while self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._size -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "size_bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "grid_deg": self.grid_deg,
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+
+class WaterMask:
+    """Per grid cell land/water verdicts learned from past marine API responses.
+
+    A cell is only skipped once land_confirmations lookups in it came back
+    with all-null series and none with water; any water answer makes it mixed
+    for good. Land verdicts are re-checked with one direct lookup after
+    land_ttl_seconds, so a cell first seen from the beach still learns about
+    water later, at the cost of a few extra lookups per inland cell.
+    """
+
+    LAND = "land"
+    WATER = "water"
+    MIXED = "mixed"
+
+    def __init__(self, grid_deg=WATER_MASK_GRID_DEG, max_cells=WATER_MASK_MAX_CELLS, path=WATER_MASK_PATH,
+                 land_confirmations=WATER_MASK_LAND_CONFIRMATIONS, land_ttl_seconds=WATER_MASK_LAND_TTL_SECONDS):
+        self.grid_deg = grid_deg
+        self.max_cells = max_cells
+        self.path = path
+        self.land_confirmations = land_confirmations
+        self.land_ttl_seconds = land_ttl_seconds
+        self._cells = OrderedDict()  # cell -> (verdict, land answers, wall time of the last land answer)
+        self._lock = threading.Lock()
+        self.skipped_lookups = 0
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def is_land(self, lat, lon):
+        with self._lock:
+            verdict, land_hits, checked_at = self._cells.get(snap_to_grid(lat, lon, self.grid_deg), (None, 0, 0))
+            if (verdict != self.LAND or land_hits < self.land_confirmations
+                    or time.time() - checked_at >= self.land_ttl_seconds):
+                return False
+            self.skipped_lookups += 1
+            return True
+
+    def record(self, lat, lon, is_water):
+        cell = snap_to_grid(lat, lon, self.grid_deg)
+        with self._lock:
+            verdict, land_hits, checked_at = self._cells.get(cell, (None, 0, 0))
+            if is_water:
+                entry = (self.WATER if verdict in (None, self.WATER) else self.MIXED, 0, 0)
+            elif verdict in (None, self.LAND):
+                entry = (self.LAND, land_hits + 1, time.time())
+            else:
+                entry = (self.MIXED, 0, 0)
+            self._cells[cell] = entry
+            self._cells.move_to_end(cell)
+            while len(self._cells) > self.max_cells:
+                self._cells.popitem(last=False)
+
+    def load(self, path):
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("grid_deg") != self.grid_deg:
+            print(f"Ignoring water mask at {path}, built for a different grid size")
+            return
+        with self._lock:
+            for row in data.get("cells", []):
+                # older files only stored the verdict, their land cells get confirmed again
+                cell_lat, cell_lon, verdict = row[:3]
+                land_hits, checked_at = row[3:5] if len(row) >= 5 else (1, time.time())
+                self._cells[(cell_lat, cell_lon)] = (verdict, land_hits, checked_at)
+
+    def save(self, path=None):
+        path = path or self.path
+        if not path:
+            return
+        with self._lock:
+            cells = [[cell_lat, cell_lon, *entry] for (cell_lat, cell_lon), entry in self._cells.items()]
+        with open(path, "w") as f:
+            json.dump({"grid_deg": self.grid_deg, "cells": cells}, f)
+
+    def stats(self):
+        verdicts = [verdict for verdict, _, _ in self._cells.values()]
+        return {
+            "cells": len(verdicts),
+            "land_cells": verdicts.count(self.LAND),
+            "water_cells": verdicts.count(self.WATER),
+            "mixed_cells": verdicts.count(self.MIXED),
+            "skipped_lookups": self.skipped_lookups,
+            "grid_deg": self.grid_deg,
+        }
+
+
+marine_cache = MarineCache()
+water_mask = WaterMask()
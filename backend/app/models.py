@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Float, String, ForeignKey, DateTime, Date, Enum as SQLEnum, Text
+from sqlalchemy import Column, Integer, Float, String, ForeignKey, DateTime, Date, Enum as SQLEnum, Text, Boolean, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime, date
 import enum
@@ -32,7 +32,7 @@ class Habit(Base):
     impact_score = Column(Float, default=1.0) 
     activity_type = Column(SQLEnum(ActivityType), default=ActivityType.OCEAN_EDUCATION) #points per check in
     timestamp = Column(DateTime, default=datetime.utcnow)
-    owner_id = Column(Integer, ForeignKey("users.id"))
+    owner_id = Column(Integer, ForeignKey("users.id"), index=True)
     
     checkins = relationship("HabitCheckIn", back_populates="habit", cascade="all, delete")
     owner = relationship("User", back_populates="habits")
@@ -47,8 +47,40 @@ class HabitCheckIn(Base):
     longitude = Column(Float, nullable=True) 
     impact_score = Column(Float, default=1.0) #points for current check in
     notes = Column(Text, nullable=True)
+    marine_status = Column(String, nullable=True) #pending/complete/failed for background enrichment
+    geohash = Column(String(12), nullable=True) #cell id, a prefix is the enclosing coarser cell
 
     habit = relationship("Habit", back_populates="checkins")
+    marine_snapshot = relationship("MarineSnapshot", back_populates="checkin", uselist=False, cascade="all, delete")
+
+    # keep in sync with migrations/versions
+    __table_args__ = (
+        Index("ix_habit_checkins_date_id", date.desc(), id.desc()), #feeds and time windows, keyset pages on (date, id)
+        Index("ix_habit_checkins_habit_id_date", habit_id, date), #per habit/user history
+        Index(
+            "ix_habit_checkins_located", latitude, longitude,
+            postgresql_where=latitude.isnot(None) & longitude.isnot(None),
+            sqlite_where=latitude.isnot(None) & longitude.isnot(None),
+        ), #map queries only touch located check-ins
+        Index("ix_habit_checkins_geohash", geohash, postgresql_ops={"geohash": "varchar_pattern_ops"}), #prefix LIKE lookups
+    )
+
+class MarineSnapshot(Base):
+    __tablename__ = "marine_snapshots"
+
+    id = Column(Integer, primary_key=True, index=True)
+    checkin_id = Column(Integer, ForeignKey("habit_checkins.id", ondelete="CASCADE"), unique=True, nullable=False)
+    wave_height = Column(Float, nullable=True)
+    sea_surface_temperature = Column(Float, nullable=True)
+    wind_speed_10m = Column(Float, nullable=True)
+    ocean_latitude = Column(Float, nullable=True) #where the conditions were actually read
+    ocean_longitude = Column(Float, nullable=True)
+    ocean_name = Column(String, nullable=True)
+    distance_km = Column(Float, default=0.0)
+    adjusted = Column(Boolean, default=False)
+    fetched_at = Column(DateTime, default=datetime.utcnow)
+
+    checkin = relationship("HabitCheckIn", back_populates="marine_snapshot")
 
 class CommunityStats(Base):
     __tablename__ = "community_stats"
@@ -59,3 +91,29 @@ class CommunityStats(Base):
     total_users = Column(Integer, default=0)
     total_impact_score = Column(Float, default=0.0)
     activity_breakdown = Column(Text) 
+    recent_weekly_checkins = Column(Integer, default=0)
+    top_contributors = Column(Text) #json list of monthly top contributors
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class CommunityCounter(Base):
+    __tablename__ = "community_counters"
+
+    name = Column(String, primary_key=True) #total_checkins, total_impact_score, activity:<type>...
+    value = Column(Float, nullable=False, default=0.0)
+
+class UserDailyScore(Base):
+    __tablename__ = "user_daily_scores"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True, index=True)
+    score = Column(Float, nullable=False, default=0.0)
+    checkins = Column(Integer, nullable=False, default=0)
+
+class CheckInMonthlySummary(Base):
+    __tablename__ = "checkin_monthly_summaries"
+
+    month = Column(Date, primary_key=True) #first day of the archived month
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    activity_type = Column(SQLEnum(ActivityType), primary_key=True)
+    checkins = Column(Integer, nullable=False, default=0)
+    impact_score = Column(Float, nullable=False, default=0.0)
@@ -1,5 +1,63 @@
-import requests
+import asyncio
 import math
+import os
+from datetime import datetime, timedelta
+
+import httpx
+import numpy as np
+
+from .marine_cache import marine_cache, water_mask
+from .spatial_index import OceanPointIndex, load_points_csv
+
+# marine api client config
+MARINE_API_URL = os.getenv("MARINE_API_URL", "https://marine-api.open-meteo.com/v1/marine")
+MARINE_CONNECT_TIMEOUT = float(os.getenv("MARINE_CONNECT_TIMEOUT", "3.0"))
+MARINE_READ_TIMEOUT = float(os.getenv("MARINE_READ_TIMEOUT", "10.0"))
+MARINE_MAX_CONNECTIONS = int(os.getenv("MARINE_MAX_CONNECTIONS", "20"))
+MARINE_MAX_CONCURRENCY = int(os.getenv("MARINE_MAX_CONCURRENCY", "10"))
+
+# above this many ocean points batch lookups go through the kd-tree instead of a distance matrix
+VECTOR_SCAN_MAX_CANDIDATES = 2048
+VECTOR_CHUNK_CELLS = 4_000_000
+
+MARINE_BATCH_SIZE = int(os.getenv("MARINE_BATCH_SIZE", "50"))  # locations per multi-coordinate request
+MARINE_HOURLY_VARIABLES = ["wave_height", "sea_surface_temperature", "wind_speed_10m"]
+
+# csv of lat,lon,name ocean sample points, falls back to the built in list
+OCEAN_POINTS_PATH = os.getenv("OCEAN_POINTS_PATH")
+
+DEFAULT_OCEAN_POINTS = [
+    # California Coast
+    {"lat": 37.5, "lon": -122.5, "name": "San Francisco Bay Area Coast"},
+    {"lat": 36.0, "lon": -121.9, "name": "Monterey Bay"},
+    {"lat": 34.0, "lon": -119.0, "name": "Southern California Coast"},
+    {"lat": 32.7, "lon": -117.2, "name": "San Diego Coast"},
+
+    # Pacific Northwest
+    {"lat": 47.6, "lon": -124.4, "name": "Washington Coast"},
+    {"lat": 45.5, "lon": -124.0, "name": "Oregon Coast"},
+
+    # East Coast
+    {"lat": 40.7, "lon": -74.0, "name": "New York Harbor"},
+    {"lat": 42.3, "lon": -71.0, "name": "Boston Harbor"},
+    {"lat": 25.8, "lon": -80.1, "name": "Miami Coast"},
+
+    # Gulf Coast
+    {"lat": 29.3, "lon": -94.8, "name": "Houston Coast"},
+    {"lat": 30.7, "lon": -88.0, "name": "Gulf of Mexico"},
+
+    # Great Lakes
+    {"lat": 42.3, "lon": -87.9, "name": "Lake Michigan"},
+    {"lat": 43.7, "lon": -79.4, "name": "Lake Ontario"},
+]
+
+_client = None
+_ocean_index = None
+_semaphore = asyncio.Semaphore(MARINE_MAX_CONCURRENCY)
+
+# in-flight upstream fetches keyed like the marine cache
+_in_flight = {}
+single_flight_stats = {"fetches": 0, "coalesced": 0}
 
 def get_distance(lat1, lon1, lat2, lon2):
     R = 6371  # Earth's radius 
@@ -17,137 +75,357 @@ def get_distance(lat1, lon1, lat2, lon2):
     return R * c
 
 
+# pairwise haversine, returns a (len(points), len(candidates)) km matrix
+def get_distances(lats1, lons1, lats2, lons2):
+    lat1 = np.radians(np.asarray(lats1, dtype=float))[:, None]
+    lon1 = np.radians(np.asarray(lons1, dtype=float))[:, None]
+    lat2 = np.radians(np.asarray(lats2, dtype=float))[None, :]
+    lon2 = np.radians(np.asarray(lons2, dtype=float))[None, :]
+    return _haversine(lat1, lon1, lat2, lon2)
+
+
+# element-wise haversine between two equal length point arrays
+def get_paired_distances(lats1, lons1, lats2, lons2):
+    return _haversine(
+        np.radians(np.asarray(lats1, dtype=float)),
+        np.radians(np.asarray(lons1, dtype=float)),
+        np.radians(np.asarray(lats2, dtype=float)),
+        np.radians(np.asarray(lons2, dtype=float)),
+    )
+
+
+def _haversine(lat1, lon1, lat2, lon2):
+    a = (np.sin((lat2 - lat1) / 2) ** 2 +
+         np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 6371 * 2 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def get_ocean_index():
+    global _ocean_index
+    if _ocean_index is None:
+        points = DEFAULT_OCEAN_POINTS
+        if OCEAN_POINTS_PATH:
+            points = load_points_csv(OCEAN_POINTS_PATH)
+            print(f"Loaded {len(points)} ocean points from {OCEAN_POINTS_PATH}")
+        _ocean_index = OceanPointIndex(points)
+    return _ocean_index
+
+
 def find_nearest_ocean_point(lat, lon):
-    ocean_points = [
-        # California Coast
-        {"lat": 37.5, "lon": -122.5, "name": "San Francisco Bay Area Coast"},
-        {"lat": 36.0, "lon": -121.9, "name": "Monterey Bay"},
-        {"lat": 34.0, "lon": -119.0, "name": "Southern California Coast"},
-        {"lat": 32.7, "lon": -117.2, "name": "San Diego Coast"},
-        
-        # Pacific Northwest
-        {"lat": 47.6, "lon": -124.4, "name": "Washington Coast"},
-        {"lat": 45.5, "lon": -124.0, "name": "Oregon Coast"},
-        
-        # East Coast
-        {"lat": 40.7, "lon": -74.0, "name": "New York Harbor"},
-        {"lat": 42.3, "lon": -71.0, "name": "Boston Harbor"},
-        {"lat": 25.8, "lon": -80.1, "name": "Miami Coast"},
-        
-        # Gulf Coast
-        {"lat": 29.3, "lon": -94.8, "name": "Houston Coast"},
-        {"lat": 30.7, "lon": -88.0, "name": "Gulf of Mexico"},
-        
-        # Great Lakes 
-        {"lat": 42.3, "lon": -87.9, "name": "Lake Michigan"},
-        {"lat": 43.7, "lon": -79.4, "name": "Lake Ontario"},
-    ]
-    
-    # find closest ocean point
-    closest_point = None
-    min_distance = float('inf')
-    
-    for point in ocean_points:
-        distance = get_distance(lat, lon, point["lat"], point["lon"])
-        if distance < min_distance:
-            min_distance = distance
-            closest_point = point
-    
-    return closest_point, min_distance
+    closest_point, _ = get_ocean_index().nearest(lat, lon)
+    if closest_point is None:
+        return None, float('inf')
+    return closest_point, get_distance(lat, lon, closest_point["lat"], closest_point["lon"])
+
+
+def find_nearest_ocean_points(lats, lons):
+    index = get_ocean_index()
+    if len(index) == 0:
+        return [(None, float('inf'))] * len(lats)
+
+    # check-ins cluster on the same spots, so resolve each distinct coordinate once
+    coords = np.column_stack([np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)])
+    unique, inverse = np.unique(coords, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    if len(index) <= VECTOR_SCAN_MAX_CANDIDATES:
+        cand_lats = np.array([p["lat"] for p in index.points])
+        cand_lons = np.array([p["lon"] for p in index.points])
+        nearest = np.empty(len(unique), dtype=int)
+        distances = np.empty(len(unique))
+        chunk = max(1, VECTOR_CHUNK_CELLS // len(index))
+        for start in range(0, len(unique), chunk):
+            block = get_distances(unique[start:start + chunk, 0], unique[start:start + chunk, 1], cand_lats, cand_lons)
+            nearest[start:start + chunk] = block.argmin(axis=1)
+            distances[start:start + chunk] = block.min(axis=1)
+        points = [index.points[i] for i in nearest]
+    else:
+        points = [index.nearest(lat, lon)[0] for lat, lon in unique]
+        distances = get_paired_distances(
+            unique[:, 0], unique[:, 1], [p["lat"] for p in points], [p["lon"] for p in points]
+        )
+
+    return [(points[i], float(distances[i])) for i in inverse]
+
+
+# shared pooled client so check-ins reuse keep-alive connections
+def get_marine_client():
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(MARINE_READ_TIMEOUT, connect=MARINE_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=MARINE_MAX_CONNECTIONS,
+                max_keepalive_connections=MARINE_MAX_CONNECTIONS,
+            ),
+        )
+    return _client
+
+
+async def close_marine_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
 
 
-def fetch_marine_data(lat=20.0, lon=-157.0):
-    url = "https://marine-api.open-meteo.com/v1/marine"
-    original_lat, original_lon = lat, lon
-    params = {
-       "latitude": lat,
-       "longitude": lon,
-       "hourly": ["wave_height", "sea_surface_temperature", "wind_speed_10m"],
+async def _get_marine_json(params, connect_timeout=None, read_timeout=None):
+    timeout = httpx.Timeout(
+        read_timeout or MARINE_READ_TIMEOUT,
+        connect=connect_timeout or MARINE_CONNECT_TIMEOUT,
+    )
+    # bound how many upstream calls are in flight at once
+    async with _semaphore:
+        response = await get_marine_client().get(MARINE_API_URL, params=params, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+def _marine_params(lats, lons):
+    return {
+       "latitude": ",".join(str(lat) for lat in lats),
+       "longitude": ",".join(str(lon) for lon in lons),
+       "hourly": MARINE_HOURLY_VARIABLES,
        "timezone": "auto",
        "forecast_days": 1
     }
 
+
+# parse each hourly series once into float arrays, nulls become NaN
+def _parse_hourly(data):
+    hourly = data["hourly"]
+    return {variable: np.array(hourly.get(variable) or [], dtype=float) for variable in MARINE_HOURLY_VARIABLES}
+
+
+def _is_land(columns):
+    # land points come back with every hourly series null
+    return all(np.isnan(column).all() for column in columns.values())
+
+
+def _current_hour_index(data):
+    times = data["hourly"].get("time") or []
+    local_now = datetime.utcnow() + timedelta(seconds=data.get("utc_offset_seconds") or 0)
     try:
-        print(f"Fetching marine data for coordinates: {lat}, {lon}")
-        response = requests.get(url, params=params)
-        response.raise_for_status() 
-        data = response.json()
-        
-        print("API keys:", list(data.keys()))
-
-        if not data.get("hourly"):
-            print("No hourly data in response")
-            return {}
-
-        #valid data exists
-        wave_data = data["hourly"].get("wave_height", [])
-        temp_data = data["hourly"].get("sea_surface_temperature", [])
-        wind_data = data["hourly"].get("wind_speed_10m", [])
-
-        #on land
-        all_wave_null = all(x is None for x in wave_data)
-        all_temp_null = all(x is None for x in temp_data)
-        all_wind_null = all(x is None for x in wind_data)
-
-        if all_wave_null and all_temp_null and all_wind_null:
+        return times.index(local_now.strftime("%Y-%m-%dT%H:00"))
+    except ValueError:
+        return 0
+
+
+def _location_info(original_lat, original_lon, ocean_lat, ocean_lon, ocean_name="Current location",
+                   distance_km=0, adjusted=False):
+    return {
+        "original_location": {"lat": original_lat, "lon": original_lon},
+        "ocean_location": {"lat": ocean_lat, "lon": ocean_lon},
+        "ocean_name": ocean_name,
+        "distance_km": distance_km,
+        "adjusted": adjusted
+    }
+
+
+def _latest_values(data, location_info, columns=None):
+    if columns is None:
+        columns = _parse_hourly(data)
+    hour = _current_hour_index(data)
+    latest = {}
+    summary = {}
+    for variable, column in columns.items():
+        valid = ~np.isnan(column)
+        if not valid.any():
+            continue
+        # current hour, else the next reading after it, else the last one before it
+        after = np.flatnonzero(valid[hour:])
+        index = hour + after[0] if after.size else np.flatnonzero(valid[:hour])[-1]
+        latest[variable] = float(column[index])
+        summary[variable] = {
+            "min": round(float(np.nanmin(column)), 2),
+            "max": round(float(np.nanmax(column)), 2),
+            "mean": round(float(np.nanmean(column)), 2),
+        }
+    latest["daily_summary"] = summary
+    latest["location_info"] = location_info
+    return latest
+
+
+async def _fetch_marine_data_uncached(lat, lon, connect_timeout=None, read_timeout=None):
+    try:
+        # inland cells we've already seen go straight to the nearest ocean point
+        on_land = water_mask.is_land(lat, lon)
+        if on_land:
+            print(f"Known inland location {lat}, {lon}, skipping direct lookup")
+        else:
+            print(f"Fetching marine data for coordinates: {lat}, {lon}")
+            data = await _get_marine_json(_marine_params([lat], [lon]), connect_timeout, read_timeout)
+
+            print("API keys:", list(data.keys()))
+
+            if not data.get("hourly"):
+                print("No hourly data in response")
+                return {}
+
+            columns = _parse_hourly(data)
+            on_land = _is_land(columns)
+            water_mask.record(lat, lon, is_water=not on_land)
+
+        if on_land:
             print("Searching for nearest ocean point.")
-            nearest_ocean, distance = find_nearest_ocean_point(original_lat, original_lon)
-         
-            if nearest_ocean:
-                print(f"Found nearest ocean point: {nearest_ocean['name']} ({distance:.1f}km away)")
-                
-                params["latitude"] = nearest_ocean["lat"]
-                params["longitude"] = nearest_ocean["lon"]
-                    
-                response = requests.get(url, params=params)
-                response.raise_for_status()
-                data = response.json()
-
-                data["location_info"] = {
-                        "original_location": {"lat": original_lat, "lon": original_lon},
-                        "ocean_location": {"lat": nearest_ocean["lat"], "lon": nearest_ocean["lon"]},
-                        "ocean_name": nearest_ocean["name"],
-                        "distance_km": round(distance, 1),
-                        "adjusted": True
-                    }
-            else:
+            nearest_ocean, distance = find_nearest_ocean_point(lat, lon)
+
+            if not nearest_ocean:
                 print("Could not find a suitable ocean point")
                 return {}
+
+            print(f"Found nearest ocean point: {nearest_ocean['name']} ({distance:.1f}km away)")
+            data = await _get_marine_json(
+                _marine_params([nearest_ocean["lat"]], [nearest_ocean["lon"]]), connect_timeout, read_timeout
+            )
+            columns = _parse_hourly(data)
+            location_info = _location_info(
+                lat, lon, nearest_ocean["lat"], nearest_ocean["lon"], nearest_ocean["name"], round(distance, 1), True
+            )
         else:
             # valid data exists
-            data["location_info"] = {
-                "original_location": {"lat": original_lat, "lon": original_lon},
-                "ocean_location": {"lat": lat, "lon": lon},
-                "ocean_name": "Current location",
-                "distance_km": 0,
-                "adjusted": False
-        }
-        latest = {}
-        if data["hourly"].get("wave_height") and len(data["hourly"]["wave_height"]) > 0:
-            for value in data["hourly"]["wave_height"]:
-                if value is not None:
-                    latest["wave_height"] = value
-                    break
-        
-        if data["hourly"].get("sea_surface_temperature") and len(data["hourly"]["sea_surface_temperature"]) > 0:
-            for value in data["hourly"]["sea_surface_temperature"]:
-                if value is not None:
-                    latest["sea_surface_temperature"] = value
-                    break
-            
-        if data["hourly"].get("wind_speed_10m") and len(data["hourly"]["wind_speed_10m"]) > 0:
-            for value in data["hourly"]["wind_speed_10m"]:
-                if value is not None:
-                    latest["wind_speed_10m"] = value
-                    break
-        latest["location_info"] = data["location_info"]
-            
+            location_info = _location_info(lat, lon, lat, lon)
+
+        latest = _latest_values(data, location_info, columns)
         print("Processed data:", latest)
         return latest
 
-    except requests.exceptions.HTTPError as e:
+    except httpx.HTTPStatusError as e:
         print("API responded with error:", e.response.text)
         return {}
+    except httpx.TimeoutException as e:
+        print("Marine API timed out:", e)
+        return {}
     except Exception as e:
         print("Error fetching marine data:", e)
         return {}
+
+
+async def _get_marine_json_multi(coords, connect_timeout=None, read_timeout=None):
+    params = _marine_params([lat for lat, _ in coords], [lon for _, lon in coords])
+    data = await _get_marine_json(params, connect_timeout, read_timeout)
+    # a single location comes back as an object, several as a list in request order
+    return data if isinstance(data, list) else [data]
+
+
+async def _fetch_many(coords, connect_timeout=None, read_timeout=None):
+    responses = {}
+    for start in range(0, len(coords), MARINE_BATCH_SIZE):
+        chunk = coords[start:start + MARINE_BATCH_SIZE]
+        try:
+            print(f"Fetching marine data for {len(chunk)} locations in one request")
+            for coord, data in zip(chunk, await _get_marine_json_multi(chunk, connect_timeout, read_timeout)):
+                if data.get("hourly"):
+                    responses[coord] = data
+        except httpx.HTTPStatusError as e:
+            print("API responded with error:", e.response.text)
+        except Exception as e:
+            print("Error fetching batched marine data:", e)
+    return responses
+
+
+def _with_original_location(cached, lat, lon):
+    result = dict(cached)
+    location_info = dict(result["location_info"])
+    location_info["original_location"] = {"lat": lat, "lon": lon}
+    if not location_info.get("adjusted"):
+        location_info["ocean_location"] = {"lat": lat, "lon": lon}
+    result["location_info"] = location_info
+    return result
+
+
+async def _fetch_and_cache(key, lat, lon, connect_timeout, read_timeout):
+    latest = await _fetch_marine_data_uncached(lat, lon, connect_timeout, read_timeout)
+    if latest:
+        marine_cache.set(key, latest)
+    return latest
+
+
+async def _single_flight(key, lat, lon, connect_timeout, read_timeout):
+    task = _in_flight.get(key)
+    if task is not None:
+        single_flight_stats["coalesced"] += 1
+    else:
+        single_flight_stats["fetches"] += 1
+        task = asyncio.ensure_future(_fetch_and_cache(key, lat, lon, connect_timeout, read_timeout))
+        _in_flight[key] = task
+        task.add_done_callback(lambda _: _in_flight.pop(key, None))
+    # shield so one cancelled caller doesn't cancel the fetch for everyone else
+    return await asyncio.shield(task)
+
+
+def get_single_flight_stats():
+    return {**single_flight_stats, "in_flight": len(_in_flight)}
+
+
+async def fetch_marine_data(lat=20.0, lon=-157.0, connect_timeout=None, read_timeout=None):
+    if lat is None or lon is None:
+        # check-ins without a location have nothing to look up
+        return {}
+
+    # nearby check-ins in the same forecast hour share one upstream result
+    key = marine_cache.make_key(lat, lon)
+    cached = marine_cache.get(key)
+    if cached is not None:
+        return _with_original_location(cached, lat, lon)
+
+    # concurrent misses for the same cell wait on a single upstream fetch
+    latest = await _single_flight(key, lat, lon, connect_timeout, read_timeout)
+    if not latest:
+        return latest
+    return _with_original_location(latest, lat, lon)
+
+
+# resolve many coordinates with one multi-location request per MARINE_BATCH_SIZE cells,
+# returning results in the same order as coords ({} where nothing could be fetched)
+async def fetch_marine_data_batch(coords, connect_timeout=None, read_timeout=None):
+    results = [{} for _ in coords]
+    cells = {}  # cache key -> first coordinate seen in that cell
+    waiting = {}  # cache key -> indexes into coords
+    for i, (lat, lon) in enumerate(coords):
+        if lat is None or lon is None:
+            continue
+        key = marine_cache.make_key(lat, lon)
+        cached = marine_cache.get(key)
+        if cached is not None:
+            results[i] = _with_original_location(cached, lat, lon)
+            continue
+        cells.setdefault(key, (lat, lon))
+        waiting.setdefault(key, []).append(i)
+
+    fetched = {}
+    inland, direct = [], []
+    for key, coord in cells.items():
+        # one is_land call per cell, each skip is counted in the mask stats
+        (inland if water_mask.is_land(*coord) else direct).append((key, coord))
+
+    responses = await _fetch_many([coord for _, coord in direct], connect_timeout, read_timeout)
+    for key, (lat, lon) in direct:
+        data = responses.get((lat, lon))
+        if data is None:
+            continue
+        columns = _parse_hourly(data)
+        if _is_land(columns):
+            water_mask.record(lat, lon, is_water=False)
+            inland.append((key, (lat, lon)))
+        else:
+            water_mask.record(lat, lon, is_water=True)
+            fetched[key] = _latest_values(data, _location_info(lat, lon, lat, lon), columns)
+
+    if inland:
+        nearest = find_nearest_ocean_points([lat for _, (lat, _) in inland], [lon for _, (_, lon) in inland])
+        ocean_coords = list({(point["lat"], point["lon"]) for point, _ in nearest if point})
+        ocean_responses = await _fetch_many(ocean_coords, connect_timeout, read_timeout)
+        for (key, (lat, lon)), (point, distance) in zip(inland, nearest):
+            data = ocean_responses.get((point["lat"], point["lon"])) if point else None
+            if data is None:
+                continue
+            fetched[key] = _latest_values(data, _location_info(
+                lat, lon, point["lat"], point["lon"], point["name"], round(distance, 1), True
+            ))
+
+    for key, latest in fetched.items():
+        marine_cache.set(key, latest)
+        for i in waiting[key]:
+            results[i] = _with_original_location(latest, *coords[i])
+    return results
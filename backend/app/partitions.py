@@ -0,0 +1,250 @@
+import asyncio
+import os
+import re
+import sys
+from datetime import date
+
+from sqlalchemy import func, inspect, select, text
+from sqlalchemy.orm import Session
+
+from . import db, models, tiles, heatmap
+from .db import upsert_add
+
+# partitioning/retention config
+CHECKIN_PARTITIONING = os.getenv("CHECKIN_PARTITIONING", "false").lower() in ("1", "true", "yes")
+CHECKIN_PARTITION_MONTHS_AHEAD = int(os.getenv("CHECKIN_PARTITION_MONTHS_AHEAD", "3"))
+CHECKIN_RETENTION_MONTHS = int(os.getenv("CHECKIN_RETENTION_MONTHS", "0"))  # 0 keeps every check-in
+PARTITION_MAINTENANCE_SECONDS = int(os.getenv("PARTITION_MAINTENANCE_SECONDS", "86400"))
+
+TABLE = "habit_checkins"
+MAINTENANCE_LOCK_ID = 4242170  # advisory lock key shared by every worker running maintenance
+PARTITION_NAME = re.compile(r"^habit_checkins_p(\d{4})(\d{2})$")
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{TABLE}_p{month:%Y%m}"
+
+
+def is_partitioned(conn) -> bool:
+    if conn.dialect.name != "postgresql":
+        return False
+    return conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = :table"
+    ), {"table": TABLE}).first() is not None
+
+
+def list_partitions(conn) -> dict:
+    # month -> partition table name, the default partition is left out
+    names = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :table"
+    ), {"table": TABLE}).scalars()
+    partitions = {}
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+# every uvicorn worker runs maintenance on the same schedule, only the one holding
+# the lock does the work; released when the caller's transaction ends
+def try_maintenance_lock(conn) -> bool:
+    if conn.dialect.name != "postgresql":
+        return True
+    return bool(conn.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": MAINTENANCE_LOCK_ID}).scalar())
+
+
+def _create_partition(conn, month: date):
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {TABLE} "
+        f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')"
+    ))
+
+
+# create this month's partition and the next few so inserts never land in the default one
+def ensure_partitions(engine=db.engine, months_ahead: int = CHECKIN_PARTITION_MONTHS_AHEAD) -> list:
+    with engine.begin() as conn:
+        if not is_partitioned(conn) or not try_maintenance_lock(conn):
+            return []
+        existing = list_partitions(conn)
+        current = month_start(date.today())
+        created = []
+        for offset in range(months_ahead + 1):
+            month = add_months(current, offset)
+            if month not in existing:
+                _create_partition(conn, month)
+                created.append(partition_name(month))
+        return created
+
+
+# one-off conversion of habit_checkins into a table range partitioned by month on date
+def enable_partitioning(engine=db.engine, months_ahead: int = CHECKIN_PARTITION_MONTHS_AHEAD) -> int:
+    if engine.dialect.name != "postgresql":
+        raise RuntimeError(f"Check-in partitioning needs postgresql, got {engine.dialect.name}")
+
+    with engine.begin() as conn:
+        if is_partitioned(conn):
+            return 0
+        first = conn.execute(text(f"SELECT min(date) FROM {TABLE}")).scalar() or date.today()
+
+        # a foreign key to a partitioned table has to include the partition key,
+        # snapshots are removed through the ORM cascade and archive_before instead
+        for fk in inspect(conn).get_foreign_keys("marine_snapshots"):
+            if fk["referred_table"] == TABLE:
+                conn.execute(text(f'ALTER TABLE marine_snapshots DROP CONSTRAINT "{fk["name"]}"'))
+
+        conn.execute(text(f"ALTER TABLE {TABLE} RENAME TO {TABLE}_legacy"))
+        conn.execute(text(f"ALTER SEQUENCE {TABLE}_id_seq OWNED BY NONE"))
+        # the partition key is part of the primary key so it can't be null
+        conn.execute(text(f"UPDATE {TABLE}_legacy SET date = CURRENT_DATE WHERE date IS NULL"))
+        conn.execute(text(
+            f"CREATE TABLE {TABLE} (LIKE {TABLE}_legacy INCLUDING DEFAULTS) PARTITION BY RANGE (date)"
+        ))
+        conn.execute(text(
+            f"ALTER TABLE {TABLE} ALTER COLUMN date SET NOT NULL, ADD PRIMARY KEY (id, date), "
+            "ADD FOREIGN KEY (habit_id) REFERENCES habits (id)"
+        ))
+        conn.execute(text(f"ALTER SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id"))
+
+        conn.execute(text(f"CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT"))
+        month = month_start(first)
+        last = add_months(month_start(date.today()), months_ahead)
+        count = 0
+        while month <= last:
+            _create_partition(conn, month)
+            month = add_months(month, 1)
+            count += 1
+
+        conn.execute(text(f"INSERT INTO {TABLE} SELECT * FROM {TABLE}_legacy"))
+        conn.execute(text(f"DROP TABLE {TABLE}_legacy"))
+        # same indexes as the model, created on the parent so every partition gets them
+        for index in models.HabitCheckIn.__table__.indexes:
+            index.create(conn)
+        return count
+
+
+def _add_to_summary(db: Session, month: date, user_id: int, activity_type, checkins: int, score: float):
+    upsert_add(
+        db, models.CheckInMonthlySummary,
+        {"month": month, "user_id": user_id, "activity_type": activity_type},
+        {"checkins": checkins, "impact_score": score},
+    )
+
+
+# first day not yet folded into monthly summaries, None if nothing was archived
+def archive_horizon(db: Session):
+    latest = db.query(func.max(models.CheckInMonthlySummary.month)).scalar()
+    return add_months(latest, 1) if latest else None
+
+
+# fold every check-in before the cutoff month into per user/activity monthly
+# summaries, then drop the detail rows (whole partitions when partitioned)
+def archive_before(db: Session, cutoff: date) -> dict:
+    cutoff = month_start(cutoff)
+    if not try_maintenance_lock(db.connection()):
+        # another worker is archiving right now, whatever it leaves is picked up next round
+        db.rollback()
+        return {"cutoff": cutoff, "archived_checkins": 0, "dropped_partitions": [], "skipped": True}
+    checkin = models.HabitCheckIn
+    first = db.query(func.min(checkin.date)).filter(checkin.date < cutoff).scalar()
+
+    archived = 0
+    month = month_start(first) if first else cutoff
+    while month < cutoff:
+        end = add_months(month, 1)
+        rows = db.query(
+            models.Habit.owner_id,
+            models.Habit.activity_type,
+            func.count(checkin.id),
+            func.coalesce(func.sum(checkin.impact_score), 0.0),
+        ).join(models.Habit, models.Habit.id == checkin.habit_id).filter(
+            checkin.date >= month, checkin.date < end, models.Habit.owner_id.isnot(None)
+        ).group_by(models.Habit.owner_id, models.Habit.activity_type).all()
+        for user_id, activity_type, count, score in rows:
+            _add_to_summary(db, month, user_id, activity_type or models.ActivityType.OCEAN_EDUCATION, count, score)
+            archived += count
+        month = end
+
+    old_ids = select(checkin.id).where(checkin.date < cutoff)
+    db.query(models.MarineSnapshot).filter(
+        models.MarineSnapshot.checkin_id.in_(old_ids)
+    ).delete(synchronize_session=False)
+
+    dropped = []
+    conn = db.connection()
+    if is_partitioned(conn):
+        for month, name in sorted(list_partitions(conn).items()):
+            if add_months(month, 1) <= cutoff:
+                conn.execute(text(f"DROP TABLE {name}"))
+                dropped.append(name)
+    # whatever is left, e.g. rows that fell into the default partition
+    db.query(checkin).filter(checkin.date < cutoff).delete(synchronize_session=False)
+    db.commit()
+    if archived:
+        tiles.tile_cache.clear()
+        heatmap.heatmap_cache.clear()
+    return {"cutoff": cutoff, "archived_checkins": archived, "dropped_partitions": dropped}
+
+
+def apply_retention(db: Session, retention_months: int = CHECKIN_RETENTION_MONTHS):
+    if retention_months <= 0:
+        return None
+    return archive_before(db, add_months(month_start(date.today()), -retention_months))
+
+
+def run_maintenance():
+    created = ensure_partitions()
+    if created:
+        print("Created check-in partitions:", ", ".join(created))
+    session = db.SessionLocal()
+    try:
+        result = apply_retention(session)
+        if result and result["archived_checkins"]:
+            print("Archived check-ins:", result)
+    finally:
+        session.close()
+
+
+async def partition_maintainer(interval_seconds: int = PARTITION_MAINTENANCE_SECONDS):
+    while True:
+        try:
+            await asyncio.to_thread(run_maintenance)
+        except Exception as e:
+            print("Partition maintenance failed:", e)
+        await asyncio.sleep(interval_seconds)
+
+
+if __name__ == "__main__":
+    # python -m app.partitions enable|ensure|archive [months]|status
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == "enable":
+        print(f"Partitioned {TABLE} into {enable_partitioning()} monthly partitions")
+    elif command == "ensure":
+        print("Created:", ", ".join(ensure_partitions()) or "nothing")
+    elif command == "archive":
+        months = int(sys.argv[2]) if len(sys.argv) > 2 else CHECKIN_RETENTION_MONTHS
+        session = db.SessionLocal()
+        try:
+            print(apply_retention(session, months) or "Retention disabled, pass a number of months to keep")
+        finally:
+            session.close()
+    elif command == "status":
+        with db.engine.connect() as conn:
+            partitioned = is_partitioned(conn)
+            print(f"{TABLE} partitioned:", partitioned)
+            for month, name in sorted(list_partitions(conn).items()) if partitioned else []:
+                print(f"  {name}  {month} .. {add_months(month, 1)}")
+    else:
+        print("usage: python -m app.partitions enable|ensure|archive [months]|status")
+        sys.exit(1)
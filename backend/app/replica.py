@@ -0,0 +1,85 @@
+import time
+
+from sqlalchemy import text
+
+# seconds the replica is behind the primary, 0 when fully replayed or not a standby
+POSTGRES_LAG_SQL = text(
+    "SELECT CASE"
+    " WHEN NOT pg_is_in_recovery() THEN 0"
+    " WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+    " ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())"
+    " END"
+)
+
+
+class ReplicaRouter:
+    """Decides whether read-only requests may use the replica.
+
+    The replica is used while it answers and its replay lag stays within
+    max_lag_seconds; otherwise reads fall back to the primary until the
+    next check, at most every check_seconds.
+    """
+
+    def __init__(self, engine, max_lag_seconds, check_seconds):
+        self.engine = engine
+        self.max_lag_seconds = max_lag_seconds
+        self.check_seconds = check_seconds
+        self.healthy = False
+        self.lag_seconds = None
+        self.last_error = None
+        self._checked_at = None
+        self.replica_reads = 0
+        self.primary_fallbacks = 0
+        self.request_errors = 0
+
+    async def _measure_lag(self):
+        async with self.engine.connect() as conn:
+            if conn.dialect.name != "postgresql":
+                await conn.execute(text("SELECT 1"))
+                return 0.0
+            return float((await conn.execute(POSTGRES_LAG_SQL)).scalar() or 0.0)
+
+    async def check(self):
+        # claim the check first so concurrent requests keep the previous verdict meanwhile
+        self._checked_at = time.monotonic()
+        try:
+            self.lag_seconds = await self._measure_lag()
+            self.last_error = None
+        except Exception as e:
+            self.lag_seconds = None
+            self.last_error = repr(e)
+        healthy = self.lag_seconds is not None and self.lag_seconds <= self.max_lag_seconds
+        if healthy != self.healthy:
+            print(f"Replica {'in use' if healthy else 'skipped'}: lag={self.lag_seconds} error={self.last_error}")
+        self.healthy = healthy
+        return healthy
+
+    # a request hit a connection or operational error on the replica, keep reads on
+    # the primary until the next periodic check instead of failing them meanwhile
+    def mark_unhealthy(self, error):
+        self.request_errors += 1
+        self.last_error = repr(error)
+        self._checked_at = time.monotonic()
+        if self.healthy:
+            print(f"Replica skipped after request error: {self.last_error}")
+        self.healthy = False
+
+    async def use_replica(self):
+        if self._checked_at is None or time.monotonic() - self._checked_at >= self.check_seconds:
+            await self.check()
+        if self.healthy:
+            self.replica_reads += 1
+        else:
+            self.primary_fallbacks += 1
+        return self.healthy
+
+    def stats(self):
+        return {
+            "healthy": self.healthy,
+            "lag_seconds": self.lag_seconds,
+            "max_lag_seconds": self.max_lag_seconds,
+            "last_error": self.last_error,
+            "replica_reads": self.replica_reads,
+            "primary_fallbacks": self.primary_fallbacks,
+            "request_errors": self.request_errors,
+        }
@@ -20,6 +20,10 @@ class HabitCheckIn(BaseModel):
     latitude: Optional[float] = None
     longitude: Optional[float] = None
     habit_description: Optional[str] = None
+    marine_status: Optional[str] = None
+    wave_height: Optional[float] = None
+    sea_surface_temperature: Optional[float] = None
+    wind_speed_10m: Optional[float] = None
 
     class Config:
         orm_mode = True
@@ -0,0 +1,55 @@
+from datetime import datetime
+
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session
+
+from . import models
+
+SNAPSHOT_FIELDS = ("wave_height", "sea_surface_temperature", "wind_speed_10m")
+
+
+def snapshot_row(checkin_id: int, marine_data: dict) -> dict:
+    location_info = marine_data.get("location_info") or {}
+    ocean_location = location_info.get("ocean_location") or {}
+    row = {field: marine_data.get(field) for field in SNAPSHOT_FIELDS}
+    row.update({
+        "checkin_id": checkin_id,
+        "ocean_latitude": ocean_location.get("lat"),
+        "ocean_longitude": ocean_location.get("lon"),
+        "ocean_name": location_info.get("ocean_name"),
+        "distance_km": location_info.get("distance_km", 0),
+        "adjusted": bool(location_info.get("adjusted")),
+        "fetched_at": datetime.utcnow(),
+    })
+    return row
+
+
+# one executemany insert for a whole batch of check-ins
+def save_marine_snapshots(db: Session, items, status: str = None) -> int:
+    rows = [snapshot_row(checkin_id, marine_data) for checkin_id, marine_data in items if marine_data]
+    if rows:
+        db.execute(insert(models.MarineSnapshot), rows)
+    if status:
+        checkin_ids = [checkin_id for checkin_id, _ in items]
+        db.execute(
+            update(models.HabitCheckIn)
+            .where(models.HabitCheckIn.id.in_(checkin_ids))
+            .values(marine_status=status)
+        )
+    db.commit()
+    return len(rows)
+
+
+def snapshot_to_dict(snapshot: models.MarineSnapshot, latitude=None, longitude=None) -> dict:
+    if snapshot is None:
+        return None
+    data = {field: getattr(snapshot, field) for field in SNAPSHOT_FIELDS if getattr(snapshot, field) is not None}
+    data["location_info"] = {
+        "original_location": {"lat": latitude, "lon": longitude},
+        "ocean_location": {"lat": snapshot.ocean_latitude, "lon": snapshot.ocean_longitude},
+        "ocean_name": snapshot.ocean_name,
+        "distance_km": snapshot.distance_km,
+        "adjusted": snapshot.adjusted,
+    }
+    data["fetched_at"] = snapshot.fetched_at
+    return data
@@ -0,0 +1,159 @@
+import csv
+import math
+import random
+import sys
+import time
+
+EARTH_RADIUS_KM = 6371
+
+
+def to_unit_vector(lat, lon):
+    lat_rad = math.radians(lat)
+    lon_rad = math.radians(lon)
+    cos_lat = math.cos(lat_rad)
+    return (cos_lat * math.cos(lon_rad), cos_lat * math.sin(lon_rad), math.sin(lat_rad))
+
+
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1_rad, lat2_rad = math.radians(lat1), math.radians(lat2)
+    a = (math.sin(math.radians(lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+# the per-request haversine scan the index replaced, kept as the reference for bench()
+def linear_nearest(points, lat, lon):
+    best, best_km = None, float("inf")
+    for point in points:
+        distance = haversine_km(lat, lon, point["lat"], point["lon"])
+        if distance < best_km:
+            best, best_km = point, distance
+    return best, best_km
+
+
+def load_points_csv(path):
+    # expects lat,lon[,name] rows, header optional
+    points = []
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if not row or row[0].strip().lower() in ("lat", "latitude"):
+                continue
+            name = row[2].strip() if len(row) > 2 and row[2].strip() else "Ocean point"
+            points.append({"lat": float(row[0]), "lon": float(row[1]), "name": name})
+    return points
+
+
+class OceanPointIndex:
+    """KD-tree over ocean sample points on the unit sphere.
+
+    Straight-line (chord) distance between unit vectors is monotonic in
+    great-circle distance, so the nearest point in 3D is the nearest on Earth.
+    """
+
+    def __init__(self, points):
+        self.points = list(points)
+        self._xyz = [to_unit_vector(p["lat"], p["lon"]) for p in self.points]
+        self._root = self._build(list(range(len(self.points))), 0)
+
+    def __len__(self):
+        return len(self.points)
+
+    def _build(self, indices, depth):
+        if not indices:
+            return None
+        axis = depth % 3
+        indices.sort(key=lambda i: self._xyz[i][axis])
+        mid = len(indices) // 2
+        # node: (point index, split axis, left subtree, right subtree)
+        return (
+            indices[mid],
+            axis,
+            self._build(indices[:mid], depth + 1),
+            self._build(indices[mid + 1:], depth + 1),
+        )
+
+    def nearest(self, lat, lon):
+        if self._root is None:
+            return None, float("inf")
+        target = to_unit_vector(lat, lon)
+        best = [None, float("inf")]  # index, squared chord distance
+        stack = [(self._root, 0.0)]
+        while stack:
+            node, plane_dist_sq = stack.pop()
+            # skip subtrees whose split plane is already farther than the best match
+            if node is None or plane_dist_sq >= best[1]:
+                continue
+            index, axis, left, right = node
+            x, y, z = self._xyz[index]
+            dist_sq = (x - target[0]) ** 2 + (y - target[1]) ** 2 + (z - target[2]) ** 2
+            if dist_sq < best[1]:
+                best[0], best[1] = index, dist_sq
+            diff = target[axis] - self._xyz[index][axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            stack.append((far, diff * diff))
+            stack.append((near, 0.0))
+        return self.points[best[0]], chord_to_km(math.sqrt(best[1]))
+
+
+def random_points(count, rng):
+    # uniform on the sphere so polar and antimeridian neighbours get exercised too
+    return [
+        {"lat": math.degrees(math.asin(rng.uniform(-1, 1))), "lon": rng.uniform(-180, 180), "name": f"p{i}"}
+        for i in range(count)
+    ]
+
+
+# check the KD-tree against the linear scan and time both
+def bench(point_count=20000, query_count=200, seed=1):
+    rng = random.Random(seed)
+    points = random_points(point_count, rng)
+    queries = [(point["lat"], point["lon"]) for point in random_points(query_count, rng)]
+    # exact duplicates of sample points and the poles/antimeridian edges
+    queries += [(points[0]["lat"], points[0]["lon"]), (90.0, 0.0), (-90.0, 0.0), (0.0, 180.0), (0.0, -180.0)]
+
+    started = time.perf_counter()
+    index = OceanPointIndex(points)
+    build_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    indexed = [index.nearest(lat, lon) for lat, lon in queries]
+    index_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    scanned = [linear_nearest(points, lat, lon) for lat, lon in queries]
+    scan_seconds = time.perf_counter() - started
+
+    # ties may resolve to different points, the distance has to agree either way
+    mismatches = [
+        (query, found, expected)
+        for query, found, expected in zip(queries, indexed, scanned)
+        if abs(found[1] - expected[1]) > 1e-6
+    ]
+    return {
+        "points": point_count,
+        "queries": len(queries),
+        "build_ms": round(build_seconds * 1000, 1),
+        "index_ms_per_query": round(index_seconds * 1000 / len(queries), 4),
+        "scan_ms_per_query": round(scan_seconds * 1000 / len(queries), 4),
+        "mismatches": mismatches,
+    }
+
+
+if __name__ == "__main__":
+    # python -m app.spatial_index bench [points] [queries]
+    if not sys.argv[1:] or sys.argv[1] != "bench":
+        print("usage: python -m app.spatial_index bench [points] [queries]")
+        sys.exit(1)
+    result = bench(*(int(arg) for arg in sys.argv[2:4]))
+    for query, found, expected in result["mismatches"]:
+        print(f"MISMATCH at {query}: index {found[1]:.6f} km, scan {expected[1]:.6f} km")
+    print(
+        f"{result['points']} points, {result['queries']} queries: build {result['build_ms']} ms, "
+        f"index {result['index_ms_per_query']} ms/query, scan {result['scan_ms_per_query']} ms/query, "
+        f"{len(result['mismatches'])} mismatches"
+    )
+    sys.exit(1 if result["mismatches"] else 0)
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import os
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import desc
+from sqlalchemy.orm import Session
+
+from . import db, models, counters, leaderboard
+
+# community stats snapshot config
+COMMUNITY_STATS_MAX_AGE_SECONDS = int(os.getenv("COMMUNITY_STATS_MAX_AGE_SECONDS", "300"))
+COMMUNITY_STATS_REFRESH_SECONDS = int(os.getenv("COMMUNITY_STATS_REFRESH_SECONDS", "120"))
+
+
+def compute_community_stats(db: Session) -> dict:
+    # totals and activity break down from the running counters
+    totals = counters.read_counters(db)
+    if counters.TOTAL_CHECKINS not in totals:
+        counters.reconcile(db)
+        totals = counters.read_counters(db)
+
+    # week activity
+    week_ago = date.today() - timedelta(days=7)
+    recent_checkins = db.query(models.HabitCheckIn).filter(
+        models.HabitCheckIn.date >= week_ago
+    ).count()
+
+    # top contributors this month
+    top_contributors = leaderboard.top_n(db, "month", 5, use_cache=False)
+
+    return {
+        "total_users": int(totals.get(counters.TOTAL_USERS, 0)),
+        "total_checkins": int(totals.get(counters.TOTAL_CHECKINS, 0)),
+        "total_impact_score": round(totals.get(counters.TOTAL_IMPACT, 0.0), 1),
+        "activity_breakdown": counters.activity_breakdown(totals),
+        "recent_weekly_checkins": recent_checkins,
+        "top_contributors": [
+            {"name": row["name"], "impact_score": row["impact_score"]}
+            for row in top_contributors
+        ]
+    }
+
+
+def stats_row_to_dict(row: models.CommunityStats) -> dict:
+    return {
+        "total_users": row.total_users,
+        "total_checkins": row.total_checkins,
+        "total_impact_score": round(row.total_impact_score or 0, 1),
+        "activity_breakdown": json.loads(row.activity_breakdown or "{}"),
+        "recent_weekly_checkins": row.recent_weekly_checkins,
+        "top_contributors": json.loads(row.top_contributors or "[]"),
+        "updated_at": row.updated_at,
+    }
+
+
+# recompute and store today's snapshot row, one row per day
+def refresh_community_stats(db: Session) -> dict:
+    stats = compute_community_stats(db)
+    row = db.query(models.CommunityStats).filter(models.CommunityStats.date == date.today()).first()
+    if row is None:
+        row = models.CommunityStats(date=date.today())
+        db.add(row)
+    row.total_users = stats["total_users"]
+    row.total_checkins = stats["total_checkins"]
+    row.total_impact_score = stats["total_impact_score"]
+    row.activity_breakdown = json.dumps(stats["activity_breakdown"])
+    row.recent_weekly_checkins = stats["recent_weekly_checkins"]
+    row.top_contributors = json.dumps(stats["top_contributors"])
+    row.updated_at = datetime.utcnow()
+    db.commit()
+    return stats_row_to_dict(row)
+
+
+# latest snapshot if it's fresh enough, read only so it can run on a replica
+def read_community_stats(db: Session, max_age_seconds: int = COMMUNITY_STATS_MAX_AGE_SECONDS):
+    row = db.query(models.CommunityStats).order_by(desc(models.CommunityStats.updated_at)).first()
+    if row is None or row.updated_at is None or datetime.utcnow() - row.updated_at > timedelta(seconds=max_age_seconds):
+        return None
+    return stats_row_to_dict(row)
+
+
+def get_community_stats(db: Session, max_age_seconds: int = COMMUNITY_STATS_MAX_AGE_SECONDS, live: bool = False) -> dict:
+    snapshot = None if live else read_community_stats(db, max_age_seconds)
+    return snapshot or refresh_community_stats(db)
+
+
+def _refresh_in_new_session():
+    session = db.SessionLocal()
+    try:
+        refresh_community_stats(session)
+    finally:
+        session.close()
+
+
+# keep the snapshot warm so dashboard loads rarely pay for a recompute
+async def community_stats_refresher(interval_seconds: int = COMMUNITY_STATS_REFRESH_SECONDS):
+    while True:
+        try:
+            await asyncio.to_thread(_refresh_in_new_session)
+        except Exception as e:
+            print("Community stats refresh failed:", e)
+        await asyncio.sleep(interval_seconds)
@@ -0,0 +1,231 @@
+import math
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from . import geo, models
+
+# activity tile config
+TILE_MAX_ZOOM = int(os.getenv("TILE_MAX_ZOOM", "18"))
+TILE_EXTENT = 4096  # positions are quantized to a 4096x4096 grid inside each tile
+TILE_MAX_POINTS = int(os.getenv("TILE_MAX_POINTS", "2000"))
+TILE_CACHE_MAX_TILES = int(os.getenv("TILE_CACHE_MAX_TILES", "4096"))
+TILE_CACHE_TTL_SECONDS = int(os.getenv("TILE_CACHE_TTL_SECONDS", "600"))  # bounds staleness across workers
+TILE_HTTP_MAX_AGE = int(os.getenv("TILE_HTTP_MAX_AGE", "30"))
+
+MERCATOR_MAX_LAT = 85.0511287798
+TILE_MAGIC = b"BST1"
+ACTIVITY_CODES = {activity: code for code, activity in enumerate(models.ActivityType)}
+
+
+def valid_tile(z, x, y) -> bool:
+    return 0 <= z <= TILE_MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def _mercator_y(lat):
+    lat = max(-MERCATOR_MAX_LAT, min(MERCATOR_MAX_LAT, lat))
+    return (1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2
+
+
+def tile_for_point(lat, lon, z):
+    n = 2 ** z
+    x = int((lon + 180) / 360 * n)
+    y = int(_mercator_y(lat) * n)
+    return z, min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_bbox(z, x, y):
+    n = 2 ** z
+    west = x / n * 360 - 180
+    east = (x + 1) / n * 360 - 180
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return south, west, north, east
+
+
+def _quantize(lats, lons, z, x, y):
+    # tile-local pixel positions, same orientation as the tile image (y grows southwards)
+    n = 2 ** z
+    lats = np.clip(np.asarray(lats, dtype=float), -MERCATOR_MAX_LAT, MERCATOR_MAX_LAT)
+    lons = np.asarray(lons, dtype=float)
+    merc_y = (1 - np.arcsinh(np.tan(np.radians(lats))) / np.pi) / 2
+    px = ((lons + 180) / 360 * n - x) * TILE_EXTENT
+    py = (merc_y * n - y) * TILE_EXTENT
+    return (
+        np.clip(px, 0, TILE_EXTENT - 1).astype(np.uint16),
+        np.clip(py, 0, TILE_EXTENT - 1).astype(np.uint16),
+    )
+
+
+class TileCache:
+    """LRU of built tiles, dropped per tile as new check-ins land in them."""
+
+    def __init__(self, max_tiles=TILE_CACHE_MAX_TILES, ttl_seconds=TILE_CACHE_TTL_SECONDS):
+        self.max_tiles = max_tiles
+        self.ttl_seconds = ttl_seconds
+        self._tiles = OrderedDict()  # (z, x, y) -> (expires_at, tile)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.stale_builds = 0
+        self._building = {}  # key -> [builds in flight, generation bumped by invalidations meanwhile]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._tiles.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._tiles.pop(key, None)
+                self.misses += 1
+                return None
+            self._tiles.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, tile):
+        with self._lock:
+            self._store(key, tile)
+
+    def _store(self, key, tile):
+        self._tiles[key] = (time.monotonic() + self.ttl_seconds, tile)
+        self._tiles.move_to_end(key)
+        while len(self._tiles) > self.max_tiles:
+            self._tiles.popitem(last=False)
+
+    # returns the tile's generation, hand it back to end_build with the built tile
+    def begin_build(self, key):
+        with self._lock:
+            entry = self._building.setdefault(key, [0, 0])
+            entry[0] += 1
+            return entry[1]
+
+    def end_build(self, key, generation, tile=None):
+        with self._lock:
+            entry = self._building[key]
+            entry[0] -= 1
+            if entry[0] == 0:
+                del self._building[key]
+            if tile is None:
+                return
+            # a check-in landed in this tile while it was being built, it may already be stale
+            if entry[1] != generation:
+                self.stale_builds += 1
+                return
+            self._store(key, tile)
+
+    # drop the one tile per zoom level that contains the point
+    def invalidate_point(self, lat, lon):
+        if lat is None or lon is None:
+            return
+        with self._lock:
+            for z in range(TILE_MAX_ZOOM + 1):
+                key = tile_for_point(lat, lon, z)
+                if key in self._building:
+                    self._building[key][1] += 1
+                if self._tiles.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            for entry in self._building.values():
+                entry[1] += 1
+            self._tiles.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "tiles": len(self._tiles),
+            "max_tiles": self.max_tiles,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "stale_builds": self.stale_builds,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+tile_cache = TileCache()
+
+
+async def _build_tile(db, z, x, y) -> dict:
+    bbox = tile_bbox(z, x, y)
+    if geo.should_cluster(z):
+        query, _ = geo.cluster_query(bbox, z)
+        rows = (await db.execute(query)).all()
+        px, py = _quantize([row.latitude for row in rows], [row.longitude for row in rows], z, x, y)
+        return {
+            "clustered": True,
+            "truncated": False,
+            "x": px,
+            "y": py,
+            "count": np.array([row.count for row in rows], dtype=np.uint32),
+            "impact": np.array([row.impact_score or 0.0 for row in rows], dtype=np.float32),
+        }
+
+    rows = (await db.execute(geo.points_query(bbox, TILE_MAX_POINTS))).all()
+    px, py = _quantize([row.latitude for row in rows], [row.longitude for row in rows], z, x, y)
+    return {
+        "clustered": False,
+        "truncated": len(rows) == TILE_MAX_POINTS,
+        "x": px,
+        "y": py,
+        "count": np.ones(len(rows), dtype=np.uint32),
+        "impact": np.array([row.impact_score or 0.0 for row in rows], dtype=np.float32),
+        "id": np.array([row.id for row in rows], dtype=np.int64),
+        "activity": np.array([ACTIVITY_CODES.get(row.activity_type, 0) for row in rows], dtype=np.uint8),
+    }
+
+
+async def get_tile(db, z, x, y) -> dict:
+    key = (z, x, y)
+    tile = tile_cache.get(key)
+    if tile is None:
+        generation = tile_cache.begin_build(key)
+        try:
+            tile = await _build_tile(db, z, x, y)
+        finally:
+            tile_cache.end_build(key, generation, tile)
+    return tile
+
+
+# columnar json, one array per field
+def encode_json(tile, z, x, y) -> dict:
+    payload = {
+        "z": z,
+        "x": x,
+        "y": y,
+        "extent": TILE_EXTENT,
+        "clustered": tile["clustered"],
+        "truncated": tile["truncated"],
+        "px": tile["x"].tolist(),
+        "py": tile["y"].tolist(),
+        "count": tile["count"].tolist(),
+        "impact": np.round(tile["impact"], 1).tolist(),
+    }
+    if not tile["clustered"]:
+        payload["id"] = tile["id"].tolist()
+        payload["activity"] = tile["activity"].tolist()
+        payload["activity_types"] = [activity.value for activity in ACTIVITY_CODES]
+    return payload
+
+
+# little endian: magic, flags(u8: 1 clustered, 2 truncated), n(u32),
+# then columns px u16[n], py u16[n], count u32[n], impact f32[n], and for points id i64[n], activity u8[n]
+def encode_binary(tile) -> bytes:
+    flags = (1 if tile["clustered"] else 0) | (2 if tile["truncated"] else 0)
+    parts = [
+        TILE_MAGIC,
+        struct.pack("<BI", flags, len(tile["x"])),
+        tile["x"].astype("<u2").tobytes(),
+        tile["y"].astype("<u2").tobytes(),
+        tile["count"].astype("<u4").tobytes(),
+        tile["impact"].astype("<f4").tobytes(),
+    ]
+    if not tile["clustered"]:
+        parts.append(tile["id"].astype("<i8").tobytes())
+        parts.append(tile["activity"].astype("u1").tobytes())
+    return b"".join(parts)
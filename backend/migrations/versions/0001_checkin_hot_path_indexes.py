@@ -0,0 +1,88 @@
+"""catch up create_all schemas and index check-in hot paths
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _columns(inspector, table):
+    return {column["name"] for column in inspector.get_columns(table)}
+
+
+def upgrade():
+    # databases created by the old import-time create_all predate these
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+
+    if "marine_status" not in _columns(inspector, "habit_checkins"):
+        op.add_column("habit_checkins", sa.Column("marine_status", sa.String(), nullable=True))
+
+    stats_columns = _columns(inspector, "community_stats")
+    if "recent_weekly_checkins" not in stats_columns:
+        op.add_column("community_stats", sa.Column("recent_weekly_checkins", sa.Integer(), nullable=True))
+    if "top_contributors" not in stats_columns:
+        op.add_column("community_stats", sa.Column("top_contributors", sa.Text(), nullable=True))
+    if "updated_at" not in stats_columns:
+        op.add_column("community_stats", sa.Column("updated_at", sa.DateTime(), nullable=True))
+
+    if "marine_snapshots" not in tables:
+        op.create_table(
+            "marine_snapshots",
+            sa.Column("id", sa.Integer(), primary_key=True, index=True),
+            sa.Column("checkin_id", sa.Integer(), sa.ForeignKey("habit_checkins.id", ondelete="CASCADE"),
+                      unique=True, nullable=False),
+            sa.Column("wave_height", sa.Float(), nullable=True),
+            sa.Column("sea_surface_temperature", sa.Float(), nullable=True),
+            sa.Column("wind_speed_10m", sa.Float(), nullable=True),
+            sa.Column("ocean_latitude", sa.Float(), nullable=True),
+            sa.Column("ocean_longitude", sa.Float(), nullable=True),
+            sa.Column("ocean_name", sa.String(), nullable=True),
+            sa.Column("distance_km", sa.Float(), nullable=True),
+            sa.Column("adjusted", sa.Boolean(), nullable=True),
+            sa.Column("fetched_at", sa.DateTime(), nullable=True),
+        )
+    if "community_counters" not in tables:
+        op.create_table(
+            "community_counters",
+            sa.Column("name", sa.String(), primary_key=True),
+            sa.Column("value", sa.Float(), nullable=False),
+        )
+    if "user_daily_scores" not in tables:
+        op.create_table(
+            "user_daily_scores",
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
+            sa.Column("day", sa.Date(), primary_key=True, index=True),
+            sa.Column("score", sa.Float(), nullable=False),
+            sa.Column("checkins", sa.Integer(), nullable=False),
+        )
+
+    # community feed, weekly counts and leaderboards filter/sort on date
+    op.create_index(
+        "ix_habit_checkins_date_id", "habit_checkins", [sa.text("date DESC"), "id"], if_not_exists=True
+    )
+    op.create_index(
+        "ix_habit_checkins_habit_id_date", "habit_checkins", ["habit_id", "date"], if_not_exists=True
+    )
+    op.create_index("ix_habits_owner_id", "habits", ["owner_id"], if_not_exists=True)
+    op.create_index(
+        "ix_habit_checkins_located", "habit_checkins", ["latitude", "longitude"],
+        postgresql_where=sa.text("latitude IS NOT NULL AND longitude IS NOT NULL"),
+        sqlite_where=sa.text("latitude IS NOT NULL AND longitude IS NOT NULL"),
+        if_not_exists=True,
+    )
+
+
+def downgrade():
+    op.drop_index("ix_habit_checkins_located", table_name="habit_checkins")
+    op.drop_index("ix_habits_owner_id", table_name="habits")
+    op.drop_index("ix_habit_checkins_habit_id_date", table_name="habit_checkins")
+    op.drop_index("ix_habit_checkins_date_id", table_name="habit_checkins")
@@ -0,0 +1,44 @@
+"""monthly summaries for archived check-ins
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+ACTIVITY_TYPES = (
+    "BEACH_CLEANUP", "PLASTIC_REDUCTION", "SUSTAINABLE_SEAFOOD",
+    "OCEAN_EDUCATION", "WATER_CONSERVATION", "WILDLIFE_PROTECTION",
+)
+
+
+def upgrade():
+    # partitioning itself is opt-in, see `python -m app.partitions enable`
+    op.create_table(
+        "checkin_monthly_summaries",
+        sa.Column("month", sa.Date(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column(
+            "activity_type",
+            # the activitytype enum already exists on postgres for habits.activity_type
+            sa.Enum(*ACTIVITY_TYPES, name="activitytype").with_variant(
+                postgresql.ENUM(*ACTIVITY_TYPES, name="activitytype", create_type=False), "postgresql"
+            ),
+            primary_key=True,
+        ),
+        sa.Column("checkins", sa.Integer(), nullable=False),
+        sa.Column("impact_score", sa.Float(), nullable=False),
+        if_not_exists=True,
+    )
+
+
+def downgrade():
+    op.drop_table("checkin_monthly_summaries")
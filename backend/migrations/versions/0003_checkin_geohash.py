@@ -0,0 +1,28 @@
+"""geohash cell per check-in
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # existing rows are filled by `python -m app.geo backfill`
+    op.add_column("habit_checkins", sa.Column("geohash", sa.String(12), nullable=True))
+    op.create_index(
+        "ix_habit_checkins_geohash", "habit_checkins", ["geohash"],
+        postgresql_ops={"geohash": "varchar_pattern_ops"},
+    )
+
+
+def downgrade():
+    op.drop_index("ix_habit_checkins_geohash", table_name="habit_checkins")
+    op.drop_column("habit_checkins", "geohash")
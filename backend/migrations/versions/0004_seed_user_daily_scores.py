@@ -0,0 +1,34 @@
+"""seed leaderboard buckets from existing check-ins
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 0001 created user_daily_scores empty, so check-ins written before it
+    # were missing from leaderboards. Rebuild every day that still has detail
+    # rows; archived days are older than any remaining check-in and are kept.
+    op.execute(
+        "DELETE FROM user_daily_scores WHERE day >= (SELECT min(date) FROM habit_checkins)"
+    )
+    op.execute(
+        "INSERT INTO user_daily_scores (user_id, day, score, checkins) "
+        "SELECT h.owner_id, c.date, COALESCE(SUM(c.impact_score), 0), COUNT(c.id) "
+        "FROM habit_checkins c JOIN habits h ON h.id = c.habit_id "
+        "WHERE h.owner_id IS NOT NULL AND c.date IS NOT NULL "
+        "GROUP BY h.owner_id, c.date"
+    )
+
+
+def downgrade():
+    # buckets are derived data, python -m app.leaderboard rebuild recreates them
+    pass
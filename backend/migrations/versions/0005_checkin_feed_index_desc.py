@@ -0,0 +1,26 @@
+"""order the feed index by (date DESC, id DESC)
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # (date DESC, id ASC) can't serve ORDER BY date DESC, id DESC or the (date, id) keyset
+    # predicate, postgres fell back to an incremental sort over whole days
+    op.drop_index("ix_habit_checkins_date_id", table_name="habit_checkins", if_exists=True)
+    op.create_index("ix_habit_checkins_date_id", "habit_checkins", [sa.text("date DESC"), sa.text("id DESC")])
+
+
+def downgrade():
+    op.drop_index("ix_habit_checkins_date_id", table_name="habit_checkins")
+    op.create_index("ix_habit_checkins_date_id", "habit_checkins", [sa.text("date DESC"), "id"])